@@ -2,14 +2,75 @@ import os
 import json
 import time
 import re
-from openai import AsyncOpenAI
+import asyncio
+import hashlib
+import importlib.util
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Callable
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except Exception:
+    orjson = None
+    HAS_ORJSON = False
+
+# Tool arguments arrive as JSON strings on every tool round.
+_loads = orjson.loads if HAS_ORJSON else json.loads
+
+VISION_MAX_SIDE = 1536
+TOOL_MAX_TOKENS = 512     # replies expected to be tool calls (segmentation prompts)
+FINAL_MAX_TOKENS = 1536   # anything that may be the answer the user reads
+MAX_CONTINUATIONS = 2     # follow-ups when an answer still stops on the length limit
+
+_SEGMENT_RE = re.compile(r"\b(?:segment|highlight|outline|mark|overlay)\w*\b", re.IGNORECASE)
+
+_BULK_RE = re.compile(r"\ball (?:the )?(?:cells|nuclei|objects)\b|\bevery(?:thing| cell)\b", re.IGNORECASE)
+
+_COUNTING_RE = re.compile(r"\b(?:how many|count|number of|total|quantity)\b", re.IGNORECASE)
+
+_REGION_RE = re.compile(r"\b(bottom|top|left|right)\b", re.IGNORECASE)
+
+_APPLIED_RE = re.compile(r"^Applied (\d+) mask")
+
+# One client (and so one connection pool) for every Agent in the process.
+# HTTP/2 lets concurrent completions share a single TLS connection; it needs
+# the optional `h2` package and falls back to HTTP/1.1 keep-alive without it.
+_CLIENT: AsyncOpenAI | None = None
+_HAS_H2 = importlib.util.find_spec("h2") is not None
+
+
+def _shared_client() -> AsyncOpenAI:
+    global _CLIENT
+    if _CLIENT is None:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY not set — export it before sending a query")
+        _CLIENT = AsyncOpenAI(
+            api_key=api_key,
+            http_client=DefaultAsyncHttpxClient(
+                http2=_HAS_H2,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+            ),
+        )
+    return _CLIENT
 
 
 class Agent:
-    def __init__(self, segmenter, debug: bool = True):
+    def __init__(self, segmenter, debug: bool = True, max_history_turns: int = 4):
         self.segmenter = segmenter
         self.debug = debug
-        self.client = None  # lazily created on first query
+        self.max_history_turns = max(1, max_history_turns)
+        self.max_tool_rounds = 4
+        self._frame_key = None   # frame_b64 the cached decode belongs to
+        self._frame_task = None  # future resolving to the decoded BGR frame
+        self._vision_key = None  # frame_b64 the cached vision data URI belongs to
+        self._vision_url_cached = None
+        self._answer_cache = OrderedDict()  # (prompt, frame digest, history digest, masks version) -> tool-free answer
+        self._answer_cache_size = 64
 
         self.tools = [
             {
@@ -31,6 +92,13 @@ class Agent:
                                 "type": "string",
                                 "enum": ["auto", "cellpose", "sam2", "opencv"],
                                 "description": "Optional backend override for mask proposals. Prefer auto unless user asks otherwise."
+                            },
+                            "apply": {
+                                "type": "boolean",
+                                "description": (
+                                    "Render the best-scoring candidates immediately, without a separate "
+                                    "apply_masks call. Use for whole-class requests like 'highlight all cells'."
+                                )
                             }
                         },
                         "required": ["query"]
@@ -73,6 +141,9 @@ class Agent:
                 }
             }
         ]
+        # The schema never changes per Agent, so build the tool kwargs once
+        # instead of rebuilding them for every completion request.
+        self._tool_kwargs = {"tools": self.tools, "tool_choice": "auto"}
 
         self.messages = [
             {
@@ -89,7 +160,10 @@ class Agent:
                     "segment, highlight, show, mark, or overlay structures.\n"
                     "  Examples: 'segment the cells', 'highlight all cells', "
                     "'show me the tissue boundaries'.\n"
-                    "• For segmentation requests, ALWAYS do this sequence:\n"
+                    "• For segmentation requests of a whole class (e.g. 'all cells', "
+                    "'red blood cells'), call 'propose_masks' once with apply=true; "
+                    "that proposes AND renders in a single step.\n"
+                    "• Only when the user wants a specific subset, do this sequence:\n"
                     "  1) call 'propose_masks' first,\n"
                     "  2) inspect returned candidates,\n"
                     "  3) call 'apply_masks' with selected indices.\n"
@@ -106,33 +180,228 @@ class Agent:
 
     @staticmethod
     def _is_counting_prompt(prompt: str) -> bool:
-        p = (prompt or "").lower()
-        patterns = [
-            r"\bhow many\b",
-            r"\bcount\b",
-            r"\bnumber of\b",
-            r"\btotal\b",
-            r"\bquantity\b",
+        return bool(_COUNTING_RE.search(prompt or ""))
+
+    @staticmethod
+    def _canonical_query(prompt: str) -> tuple[str, str]:
+        """``(segmenter query, region)`` for *prompt*; region may be "".
+
+        The segmenter's query matching is keyword-based, so it gets a
+        canonical query rather than the raw prompt ("stop" is not "top").
+        """
+        match = _REGION_RE.search(prompt)
+        region = match.group(1).lower() if match else ""
+        return (f"all cells {region}" if region else "all cells"), region
+
+    @staticmethod
+    def _text_only(message: dict) -> dict:
+        """Drop image parts from a multimodal user message."""
+        content = message.get("content")
+        if not isinstance(content, list):
+            return message
+        text = " ".join(part.get("text", "") for part in content if part.get("type") == "text")
+        return {"role": message["role"], "content": text}
+
+    def _compact_history(self) -> None:
+        """Keep the system prompt plus the last few user/assistant turns.
+
+        Tool traffic is dropped once a turn has finished; the final assistant
+        text already summarises it and the model never needs the JSON again.
+        """
+        system, history = self.messages[:1], self.messages[1:]
+        starts = [i for i, m in enumerate(history) if m["role"] == "user"]
+        if len(starts) > self.max_history_turns:
+            history = history[starts[-self.max_history_turns]:]
+
+        self.messages = system + [
+            self._text_only(m)
+            for m in history
+            if m["role"] != "tool" and not m.get("tool_calls")
         ]
-        return any(re.search(pattern, p) for pattern in patterns)
+
+    def _history_digest(self) -> bytes:
+        """Digest of the text history (everything after the system prompt)."""
+        digest = hashlib.blake2b(digest_size=8)
+        for m in self.messages[1:]:
+            digest.update(f"{m['role']}\0{m.get('content') or ''}\0".encode("utf-8", "ignore"))
+        return digest.digest()
 
     def _get_client(self) -> AsyncOpenAI:
-        if self.client is None:
-            api_key = os.getenv("OPENAI_API_KEY")
-            if not api_key:
-                raise ValueError("OPENAI_API_KEY not set — export it before sending a query")
-            self.client = AsyncOpenAI(api_key=api_key)
-        return self.client
-
-    async def _completion(self, messages: list, tools: list | None = None):
-        kwargs: dict = {"model": "gpt-4o", "messages": messages}
-        if tools:
-            kwargs["tools"] = tools
-            kwargs["tool_choice"] = "auto"
-        response = await self._get_client().chat.completions.create(**kwargs)
-        return response.choices[0].message
-
-    async def query(self, prompt: str, frame_b64: str | None = None) -> str:
+        return _shared_client()
+
+    async def _completion(
+        self,
+        messages: list,
+        use_tools: bool = False,
+        max_tokens: int | None = None,
+        on_token: Callable[[str], Awaitable[None]] | None = None,
+    ) -> dict:
+        """Stream a completion, forwarding content deltas to *on_token*.
+
+        Tool-call deltas are assembled per index so the returned message has
+        the same shape as the non-streaming API: content, tool_calls and the
+        finish_reason of the (single) choice.
+        """
+        kwargs: dict = {"model": "gpt-4o", "messages": messages, "stream": True}
+        if use_tools:
+            kwargs.update(self._tool_kwargs)
+        if max_tokens:
+            kwargs["max_tokens"] = max_tokens
+        stream = await self._get_client().chat.completions.create(**kwargs)
+
+        content_parts: list[str] = []
+        tool_calls: dict[int, dict] = {}
+        finish_reason = None
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            delta = choice.delta
+            if delta.content:
+                content_parts.append(delta.content)
+                if on_token is not None:
+                    await on_token(delta.content)
+            for tc in delta.tool_calls or []:
+                slot = tool_calls.setdefault(tc.index, {
+                    "id": None,
+                    "type": "function",
+                    "function": {"name": "", "arguments": ""},
+                })
+                if tc.id:
+                    slot["id"] = tc.id
+                if tc.function is not None:
+                    if tc.function.name:
+                        slot["function"]["name"] += tc.function.name
+                    if tc.function.arguments:
+                        slot["function"]["arguments"] += tc.function.arguments
+            if choice.finish_reason:
+                finish_reason = choice.finish_reason
+
+        return {
+            "content": "".join(content_parts) or None,
+            "tool_calls": [tool_calls[i] for i in sorted(tool_calls)],
+            "finish_reason": finish_reason,
+        }
+
+    async def _continue_truncated(
+        self,
+        messages: list,
+        message: dict,
+        on_token: Callable[[str], Awaitable[None]] | None = None,
+    ) -> dict:
+        """Complete an answer that stopped on the token limit.
+
+        The partial text is fed back as the assistant's turn and the model
+        asked to carry on; continuations stream through *on_token* and are
+        appended, so the caller gets (and the client sees) one answer.
+        """
+        content = message["content"]
+        finish_reason = message["finish_reason"]
+        for _ in range(MAX_CONTINUATIONS):
+            if finish_reason != "length":
+                break
+            if self.debug:
+                print("ℹ️ Answer hit the token limit: continuing")
+            more = await self._completion(
+                messages + [
+                    {"role": "assistant", "content": content},
+                    {"role": "user", "content": "Continue exactly where you stopped, without repeating anything."},
+                ],
+                max_tokens=FINAL_MAX_TOKENS,
+                on_token=on_token,
+            )
+            content += more["content"] or ""
+            finish_reason = more["finish_reason"]
+        return {**message, "content": content, "finish_reason": finish_reason}
+
+    def _frame_image(self, frame_b64: str) -> asyncio.Future:
+        """Decode *frame_b64* once and share the result across tool calls."""
+        if self._frame_key is not frame_b64:
+            self._frame_key = frame_b64
+            self._frame_task = asyncio.ensure_future(
+                asyncio.to_thread(self.segmenter.decode_frame, frame_b64)
+            )
+        return self._frame_task
+
+    async def _vision_url(self, frame_b64: str) -> str:
+        """Data URI for the vision prompt, downscaled to what gpt-4o can use.
+
+        Pixels beyond VISION_MAX_SIDE on the long edge are only uploaded and
+        billed, never seen, so larger frames are shrunk before sending.
+        """
+        if frame_b64 == self._vision_key:
+            return self._vision_url_cached
+
+        url = frame_b64 if frame_b64.startswith("data:") else "data:image/jpeg;base64," + frame_b64
+        img = await self._frame_image(frame_b64)
+        if img is not None and max(img.shape[:2]) > VISION_MAX_SIDE:
+            scaled = await asyncio.to_thread(self.segmenter.encode_scaled, img, VISION_MAX_SIDE)
+            url = "data:image/jpeg;base64," + scaled
+
+        self._vision_key = frame_b64
+        self._vision_url_cached = url
+        return url
+
+    async def _dispatch(self, name: str, args: dict, frame_b64: str | None) -> str:
+        result = "No action taken."
+
+        if name == "propose_masks":
+            query = (args.get("query") or "all cells").strip()
+            backend = (args.get("backend") or "auto").strip().lower()
+            frame_img = await self._frame_image(frame_b64) if frame_b64 else None
+            if args.get("apply"):
+                result = await self.segmenter.segment(query, frame_b64, backend=backend, frame_img=frame_img)
+            else:
+                result = await self.segmenter.propose_masks(query, frame_b64, backend=backend, frame_img=frame_img)
+        elif name == "apply_masks":
+            indices = args.get("indices") or []
+            query = (args.get("query") or "selected masks").strip()
+            result = await asyncio.to_thread(self.segmenter.apply_masks, indices, query=query)
+        elif name == "clear_masks":
+            result = await asyncio.to_thread(self.segmenter.clear_masks)
+
+        if self.debug:
+            print(f"✅ Tool call: {name} {args} → {result}")
+        return result
+
+    async def _run_tool_calls(self, tool_calls: list[dict], frame_b64: str | None) -> list[str]:
+        """Run one turn's tool calls in call order, searches overlapped.
+
+        Every propose_masks replaces the current proposals, and apply_masks
+        picks ids out of them, so the calls themselves run one after another
+        and the state matches what the model read last. The contour searches
+        behind them, the expensive part, are all started up front and run
+        concurrently; each propose_masks then just awaits its own.
+        """
+        calls = [
+            (tool_call["function"]["name"], _loads(tool_call["function"]["arguments"] or "{}"))
+            for tool_call in tool_calls
+        ]
+        if frame_b64:
+            # SAM2 searches of one frame share the generator output
+            # (_sam2_masks), so those are left to run one after another.
+            searches = [
+                args for name, args in calls
+                if name == "propose_masks" and (args.get("backend") or "auto").strip().lower() != "sam2"
+            ]
+            if len(searches) > 1:
+                frame_img = await self._frame_image(frame_b64)
+                for args in searches:
+                    self.segmenter.prefetch_contours(
+                        (args.get("query") or "all cells").strip(),
+                        frame_b64,
+                        frame_img,
+                        backend=(args.get("backend") or "auto").strip().lower(),
+                    )
+
+        return [await self._dispatch(name, args, frame_b64) for name, args in calls]
+
+    async def query(
+        self,
+        prompt: str,
+        frame_b64: str | None = None,
+        on_token: Callable[[str], Awaitable[None]] | None = None,
+    ) -> str:
         if self.debug:
             print(f"ℹ️ Agent received prompt: {prompt[:100]}{'...' if len(prompt) > 100 else ''}")
 
@@ -142,24 +411,83 @@ class Agent:
             if self.debug:
                 print("ℹ️ Auto-attached latest frame for vision")
 
+        # Asking the same question about the same frame (common in demos)
+        # replays the earlier answer instead of another VLM round-trip. The
+        # conversation and overlay are part of the key: "why?" or "what did
+        # you just highlight?" depend on them.
+        frame_digest = hashlib.blake2b(frame_b64.encode("ascii", "ignore"), digest_size=8).digest() if frame_b64 else b""
+        answer_key = (prompt.strip().lower(), frame_digest, self._history_digest(), self.segmenter.masks_version)
+        cached = self._answer_cache.get(answer_key)
+        if cached is not None:
+            self._answer_cache.move_to_end(answer_key)
+            if on_token is not None:
+                await on_token(cached)
+            self.messages.append({"role": "user", "content": prompt})
+            self.messages.append({"role": "assistant", "content": cached})
+            self._compact_history()
+            if self.debug:
+                print("ℹ️ Answer cache hit: skipped the LLM call")
+            return cached
+
+        is_counting = self._is_counting_prompt(prompt)
+        if self.debug and is_counting:
+            print("ℹ️ Counting prompt detected: tools disabled for this turn")
+
+        if frame_b64 and not is_counting and _SEGMENT_RE.search(prompt) and _BULK_RE.search(prompt):
+            # "Highlight all cells" needs no model judgement: propose + apply
+            # directly and skip the LLM round-trips entirely.
+            query, region = self._canonical_query(prompt)
+            where = f" in the {region} half" if region else ""
+            frame_img = await self._frame_image(frame_b64)
+            result = await self.segmenter.segment(query, frame_b64, backend="auto", frame_img=frame_img)
+            applied = _APPLIED_RE.match(result)
+            if applied:
+                n = int(applied.group(1))
+                assistant_text = f"Highlighted {n} cell{'s' if n != 1 else ''}{where}."
+            else:
+                assistant_text = f"I couldn't find any cells to highlight{where} in this frame."
+            if on_token is not None:
+                await on_token(assistant_text)
+            self.messages.append({"role": "user", "content": prompt})
+            self.messages.append({"role": "assistant", "content": assistant_text})
+            self._compact_history()
+            if self.debug:
+                print(f"ℹ️ Bulk segmentation fast path: {result[:100]}")
+            return assistant_text
+
+        if frame_b64 and not is_counting and _SEGMENT_RE.search(prompt):
+            # Likely a segmentation turn: find contours while the model thinks.
+            frame_img = await self._frame_image(frame_b64)
+            self.segmenter.prefetch_contours(self._canonical_query(prompt)[0], frame_b64, frame_img, backend="auto")
+
         current_message = {"role": "user", "content": prompt}
         if frame_b64:
             current_message["content"] = [
                 {"type": "text", "text": prompt},
-                {"type": "image_url", "image_url": {"url": frame_b64}}
+                {"type": "image_url", "image_url": {"url": await self._vision_url(frame_b64)}}
             ]
 
-        is_counting = self._is_counting_prompt(prompt)
-        if self.debug and is_counting:
-            print("ℹ️ Counting prompt detected: tools disabled for this turn")
+        # This turn works on a snapshot of the history plus its own messages;
+        # another query() may compact self.messages while this one awaits, so
+        # the turn is merged back in once, at the end. History only keeps the
+        # text; the frame goes into this turn's requests only, so old images
+        # are never re-uploaded.
+        history = list(self.messages)
+        turn = [self._text_only(current_message)]
 
-        self.messages.append(current_message)
+        def outgoing() -> list:
+            return history + [current_message] + turn[1:]
 
+        # Only a segmentation prompt's first reply is expected to be a tool
+        # call; any other reply may be the answer itself and gets full room.
+        expects_tools = not is_counting and bool(_SEGMENT_RE.search(prompt))
         start_time = time.time()
         try:
             message = await self._completion(
-                self.messages,
-                tools=None if is_counting else self.tools,
+                outgoing(),
+                use_tools=not is_counting,
+                max_tokens=TOOL_MAX_TOKENS if expects_tools else FINAL_MAX_TOKENS,
+                on_token=on_token,
             )
         except Exception as e:
             print(f"⚠️ Agent query error: {e}")
@@ -171,54 +499,88 @@ class Agent:
 
         rounds = 0
         tool_results: list[str] = []
-        while (not is_counting) and message.tool_calls and rounds < 4:
+        while (not is_counting) and rounds < self.max_tool_rounds:
             rounds += 1
-            self.messages.append({
+            if message["finish_reason"] == "length" and message["tool_calls"]:
+                # Tool arguments were cut off mid-JSON. Drop the oldest history
+                # message from this turn's requests and retry once with the
+                # larger budget.
+                if len(history) > 1:
+                    del history[1]
+                # The client already has the first attempt's text: hold the
+                # retry's back, and only stream what is new once it turns out
+                # to be the reply rather than another tool-call preamble.
+                streamed = message["content"] or ""
+                message = await self._completion(outgoing(), use_tools=True, max_tokens=FINAL_MAX_TOKENS)
+                text = message["content"] or ""
+                if on_token is not None and text and not message["tool_calls"]:
+                    fresh = text[len(streamed):] if text.startswith(streamed) else text
+                    if fresh:
+                        await on_token(fresh)
+                if message["finish_reason"] == "length":
+                    break
+                continue
+            if message["finish_reason"] != "tool_calls" or not message["tool_calls"]:
+                break
+
+            turn.append({
                 "role": "assistant",
-                "content": message.content,
-                "tool_calls": [
-                    {
-                        "id": tc.id,
-                        "type": "function",
-                        "function": {
-                            "name": tc.function.name,
-                            "arguments": tc.function.arguments,
-                        },
-                    }
-                    for tc in message.tool_calls
-                ],
+                "content": message["content"],
+                "tool_calls": message["tool_calls"],
             })
 
-            for tool_call in message.tool_calls:
-                args = json.loads(tool_call.function.arguments or "{}")
-                result = "No action taken."
-
-                if tool_call.function.name == "propose_masks":
-                    query = (args.get("query") or "all cells").strip()
-                    backend = (args.get("backend") or "auto").strip().lower()
-                    result = await self.segmenter.propose_masks(query, frame_b64, backend=backend)
-                elif tool_call.function.name == "apply_masks":
-                    indices = args.get("indices") or []
-                    query = (args.get("query") or "selected masks").strip()
-                    result = self.segmenter.apply_masks(indices, query=query)
-                elif tool_call.function.name == "clear_masks":
-                    result = self.segmenter.clear_masks()
-
+            results = await self._run_tool_calls(message["tool_calls"], frame_b64)
+            for tool_call, result in zip(message["tool_calls"], results):
                 tool_results.append(result)
-                self.messages.append({
+                turn.append({
                     "role": "tool",
-                    "tool_call_id": tool_call.id,
+                    "tool_call_id": tool_call["id"],
                     "content": result,
                 })
-                if self.debug:
-                    print(f"✅ Tool call: {tool_call.function.name} {args} → {result}")
 
-            message = await self._completion(self.messages, tools=self.tools)
+            # After the tools ran, the reply is usually the final answer.
+            message = await self._completion(
+                outgoing(), use_tools=True, max_tokens=FINAL_MAX_TOKENS, on_token=on_token
+            )
+
+        if message["content"] and not message["tool_calls"]:
+            message = await self._continue_truncated(outgoing(), message, on_token)
 
-        assistant_text = message.content or ("; ".join(tool_results) if tool_results else "I processed your request.")
-        self.messages.append({"role": "assistant", "content": assistant_text})
+        assistant_text = message["content"] or ("; ".join(tool_results) if tool_results else "I processed your request.")
+        if not message["content"] and on_token is not None:
+            # Nothing was streamed for the final turn; emit the fallback text.
+            await on_token(assistant_text)
+        turn.append({"role": "assistant", "content": assistant_text})
+        self.messages.extend(turn)
+        self._compact_history()
+
+        if not tool_results and message["finish_reason"] == "stop":
+            # Only pure answers are replayable; tool turns change the overlay.
+            self._answer_cache[answer_key] = assistant_text
+            while len(self._answer_cache) > self._answer_cache_size:
+                self._answer_cache.popitem(last=False)
 
         if self.debug:
             print(f"ℹ️ Agent response: {assistant_text[:100]}{'...' if len(assistant_text) > 100 else ''}")
 
         return assistant_text
+
+    async def query_stream(self, prompt: str, frame_b64: str | None = None) -> AsyncIterator[str]:
+        """Same as :meth:`query`, but yields response tokens as they arrive."""
+        tokens: asyncio.Queue = asyncio.Queue()
+
+        async def on_token(token: str) -> None:
+            await tokens.put(token)
+
+        task = asyncio.create_task(self.query(prompt, frame_b64, on_token=on_token))
+        task.add_done_callback(lambda _: tokens.put_nowait(None))
+
+        try:
+            while (token := await tokens.get()) is not None:
+                yield token
+            await task
+        finally:
+            # The client went away mid-answer: stop the turn rather than let
+            # it apply masks and grow history for nobody.
+            if not task.done():
+                task.cancel()
@@ -1,14 +1,26 @@
 import asyncio
 import json
+import sys
 
 import uvicorn
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
 from agent import Agent
 from tracker import Segmenter
 
+try:
+    import orjson
+    HAS_ORJSON = True
+except Exception:
+    orjson = None
+    HAS_ORJSON = False
+
+# Legacy clients wrap every frame in JSON; orjson also parses bytes directly.
+_loads = orjson.loads if HAS_ORJSON else json.loads
+
 app = FastAPI()
 
 app.add_middleware(
@@ -35,19 +47,35 @@ async def query_endpoint(request: ChatRequest):
     return {"response": response}
 
 
-def _extract_frame(message: dict) -> str | None:
-    if "text" in message:
+@app.post("/query/stream")
+async def query_stream_endpoint(request: ChatRequest):
+    return StreamingResponse(
+        agent.query_stream(request.prompt, request.frame),
+        media_type="text/plain; charset=utf-8",
+    )
+
+
+def _extract_frame(message: dict) -> str | bytes | None:
+    """Pull the frame out of a WS message.
+
+    Raw JPEG bytes are returned as-is so they never go through base64;
+    older clients sending JSON ({"frame": ...}) or bare base64 get a str.
+    """
+    if "text" in message and message["text"] is not None:
         try:
-            data = json.loads(message["text"])
+            data = _loads(message["text"])
             return data.get("frame")
         except Exception:
             return message["text"]
-    if "bytes" in message:
+    if "bytes" in message and message["bytes"] is not None:
+        payload = message["bytes"]
+        if payload[:2] == b"\xff\xd8":  # JPEG SOI marker
+            return payload
         try:
-            data = json.loads(message["bytes"])
+            data = _loads(payload)
             return data.get("frame")
         except Exception:
-            return message["bytes"].decode("utf-8")
+            return payload.decode("utf-8")
     return None
 
 
@@ -56,7 +84,16 @@ async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     print("✅ WS Connected")
 
-    latest_frame: dict = {"data": None, "event": asyncio.Event()}
+    # Single-slot mailbox: a newer message replaces one that was never
+    # processed, and decoding waits until the processor actually takes it.
+    latest_message: asyncio.Queue = asyncio.Queue(maxsize=1)
+
+    def offer(message: dict | None) -> None:
+        try:
+            latest_message.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+        latest_message.put_nowait(message)
 
     async def receiver():
         try:
@@ -64,26 +101,34 @@ async def websocket_endpoint(websocket: WebSocket):
                 message = await websocket.receive()
                 if message["type"] == "websocket.disconnect":
                     raise WebSocketDisconnect()
-                frame = _extract_frame(message)
-                if frame:
-                    latest_frame["data"] = frame
-                    latest_frame["event"].set()
+                offer(message)
         except (WebSocketDisconnect, Exception):
-            latest_frame["event"].set()
+            offer(None)  # wake the processor so it can exit
             raise
 
     async def processor():
         try:
             while True:
-                await latest_frame["event"].wait()
-                latest_frame["event"].clear()
+                message = await latest_message.get()
+                if message is None:
+                    return
+
+                frame = _extract_frame(message)
+                if not frame:
+                    continue
 
-                frame = latest_frame["data"]
-                if frame is None:
+                if isinstance(frame, bytes):
+                    # Binary in, binary out: no base64 or JSON on either side.
+                    try:
+                        edited_jpeg = await segmenter.render(frame)
+                    except Exception as render_err:
+                        print(f"⚠️ Frame render error: {render_err}")
+                        edited_jpeg = frame
+                    await websocket.send_bytes(edited_jpeg)
                     continue
 
                 try:
-                    edited_frame = await asyncio.to_thread(segmenter.render_frame, frame)
+                    edited_frame = await segmenter.render(frame)
                 except Exception as render_err:
                     print(f"⚠️ Frame render error: {render_err}")
                     edited_frame = frame.split(",", 1)[-1] if "," in frame else frame
@@ -101,4 +146,17 @@ async def websocket_endpoint(websocket: WebSocket):
 
 
 if __name__ == "__main__":
-    uvicorn.run("server:app", host="0.0.0.0", port=8000, reload=True, timeout_keep_alive=300000)
+    dev = "--dev" in sys.argv
+    uvicorn.run(
+        "server:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=dev,  # autoreloader only while developing
+        loop="auto",  # uvloop / httptools whenever they're installed
+        http="auto",
+        ws="websockets",
+        ws_ping_interval=None,  # no keepalive pings interleaved with video frames
+        ws_max_size=8 * 1024 * 1024,
+        ws_per_message_deflate=False,  # JPEG payloads don't compress; skip the zlib pass
+        timeout_keep_alive=300000,
+    )
@@ -1,19 +1,63 @@
 import base64
 import asyncio
+import contextlib
+import functools
+import hashlib
+import heapq
 import json
 import os
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 
 try:
-    from scipy import ndimage as ndi
-    from skimage import segmentation, feature
-    HAS_SKIMAGE = True
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJSAMP_420
+    _TURBOJPEG = TurboJPEG()  # raises if libturbojpeg itself is missing
+    HAS_TURBOJPEG = True
 except Exception:
-    ndi = None
-    segmentation = None
-    feature = None
-    HAS_SKIMAGE = False
+    _TURBOJPEG = None
+    HAS_TURBOJPEG = False
+
+try:
+    import pybase64 as _b64  # SIMD base64, drop-in for the stdlib calls used here
+    HAS_PYBASE64 = True
+except Exception:
+    _b64 = base64
+    HAS_PYBASE64 = False
+
+try:
+    import xxhash
+    HAS_XXHASH = True
+except Exception:
+    xxhash = None
+    HAS_XXHASH = False
+
+try:
+    import numba
+    from numba import njit, prange
+    # Segmentation runs in worker threads; once a parallel kernel has run off
+    # the main thread, numba's default TBB layer hangs interpreter exit.
+    if "NUMBA_THREADING_LAYER" not in os.environ:
+        numba.config.THREADING_LAYER_PRIORITY = ["omp", "tbb", "workqueue"]
+    HAS_NUMBA = True
+except Exception:
+    numba = None
+    njit = None
+    prange = range
+    HAS_NUMBA = False
+
+try:
+    import torch
+    if torch.cuda.is_available():
+        # Fixed input sizes: let cuDNN pick its fastest kernels once, and
+        # allow TF32 for whatever runs outside autocast.
+        torch.backends.cudnn.benchmark = True
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+except Exception:
+    torch = None
 
 try:
     from cellpose import models as cellpose_models
@@ -23,27 +67,156 @@ except Exception:
     HAS_CELLPOSE = False
 
 try:
-    import torch
     from sam2.build_sam import build_sam2
     from sam2.automatic_mask_generator import SAM2AutomaticMaskGenerator
-    HAS_SAM2 = True
+    HAS_SAM2 = torch is not None
 except Exception:
-    torch = None
     build_sam2 = None
     SAM2AutomaticMaskGenerator = None
     HAS_SAM2 = False
 
 
+def _payload_hash(data: bytes):
+    """Cheap identity hash of a frame payload (xxh3 when available)."""
+    if HAS_XXHASH:
+        return xxhash.xxh3_64_intdigest(data)
+    return hashlib.blake2b(data, digest_size=8).digest()
+
+
+# 0..255 in each of three channels; the domain of the overlay blend LUTs.
+_LEVELS3 = np.repeat(np.arange(256, dtype=np.uint8).reshape(1, 256, 1), 3, axis=2)
+
+
+@functools.lru_cache(maxsize=None)
+def _ellipse(size: int) -> np.ndarray:
+    """Shared (read-only) elliptical structuring element of *size* x *size*."""
+    return cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size))
+
+
+@functools.lru_cache(maxsize=None)
+def _rect(size: int) -> np.ndarray:
+    """Shared (read-only) rectangular structuring element of *size* x *size*."""
+    return cv2.getStructuringElement(cv2.MORPH_RECT, (size, size))
+
+
+_PARALLEL_LOCK = threading.Lock()
+
+
+def _parallel_guard():
+    """Context that serializes parallel numba launches when they aren't thread-safe.
+
+    The workqueue layer (what numba falls back to without OpenMP or TBB)
+    aborts the process on concurrent launches. The layer is only known once
+    something has launched, so until then launches are serialized too.
+    """
+    try:
+        layer = numba.threading_layer()
+    except ValueError:
+        return _PARALLEL_LOCK
+    return _PARALLEL_LOCK if layer == "workqueue" else contextlib.nullcontext()
+
+
+# Query keywords that change proposal scoring; `cell` is only set when `rbc` is not.
+_QueryFlags = namedtuple("_QueryFlags", "rbc cell large small")
+
+
+if HAS_NUMBA:
+    @njit(parallel=True, cache=True)
+    def _vote_kernel(gray_blur, otsu_thr, m_adapt, gray_norm_blur, otsu_norm_thr, m_adapt_norm,
+                     blackhat, bh_thr, sat, s_thr, a, b, med_a, med_b, dev_thr, red_thr, roi, out):
+        """Fused 8-cue vote (>= 3 of 8) AND roi, in one pass over the frame."""
+        h, w = out.shape
+        for y in prange(h):
+            for x in range(w):
+                if roi[y, x] == 0:
+                    out[y, x] = 0
+                    continue
+                votes = 0
+                if gray_blur[y, x] <= otsu_thr:
+                    votes += 1
+                if m_adapt[y, x] != 0:
+                    votes += 1
+                if gray_norm_blur[y, x] <= otsu_norm_thr:
+                    votes += 1
+                if m_adapt_norm[y, x] != 0:
+                    votes += 1
+                if blackhat[y, x] > bh_thr:
+                    votes += 1
+                if sat[y, x] > s_thr:
+                    votes += 1
+                if abs(np.int32(a[y, x]) - med_a) + abs(np.int32(b[y, x]) - med_b) > dev_thr:
+                    votes += 1
+                if a[y, x] > red_thr:
+                    votes += 1
+                out[y, x] = 255 if votes >= 3 else 0
+
+    @njit(cache=True)
+    def _flood_kernel(dist, mask, labels):
+        """Marker watershed of -*dist* within *mask*, in place on *labels*.
+
+        Same flooding order as skimage's watershed(-dist, markers, mask=...):
+        4-connected, highest distance first, ties in push order.
+        """
+        h, w = labels.shape
+        heap = [(np.float32(0.0), np.int64(0), np.int64(0))]
+        heap.pop()
+        age = 0
+        for y in range(h):
+            for x in range(w):
+                if labels[y, x] > 0:
+                    heapq.heappush(heap, (-dist[y, x], np.int64(age), np.int64(y * w + x)))
+                    age += 1
+        while heap:
+            _, _, idx = heapq.heappop(heap)
+            y, x = idx // w, idx % w
+            label = labels[y, x]
+            for dy, dx in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+                ny, nx = y + dy, x + dx
+                if ny < 0 or ny >= h or nx < 0 or nx >= w:
+                    continue
+                if labels[ny, nx] != 0 or mask[ny, nx] == 0:
+                    continue
+                labels[ny, nx] = label
+                heapq.heappush(heap, (-dist[ny, nx], np.int64(age), np.int64(ny * w + nx)))
+                age += 1
+
+
 class Segmenter:
     """Simple static segmentation - no tracking, just segment and render."""
     
     def __init__(self):
-        self.active_masks = []        # List of {contours, color, query} dicts
-        self.latest_proposals = []    # List of {contour, area, circularity, center, bbox, score}
-        self._latest_b64 = None       # raw base64 (no data-uri prefix)
+        self.active_masks = []        # List of {contours, color, query} dicts; replaced, never mutated
+        self._masks_version = 0       # bumped whenever active_masks changes
+        self._render_cache = (None, None, None)  # ((payload hash, masks version), rendered frame, source JPEG)
+        # (contour id, h, w) -> (contour, clipped bbox, filled bbox patch) or None
+        self._contour_rasters = OrderedDict()
+        self._contour_rasters_size = 1024
+        # Proposals are kept column-wise, best score first: contours in a
+        # list, everything else in arrays (see _FEATURES for the columns).
+        self._proposal_contours = []
+        self._proposal_features = np.empty((0, len(self._FEATURES)), dtype=np.float64)
+        self._proposal_scores = np.empty(0, dtype=np.float64)
+        self._proposal_ids = np.empty(0, dtype=np.int64)  # stable per-contour ids
+        self._next_contour_id = 0
+        self._proposal_view = None    # lazily built latest_proposals dicts
+        self._latest = (None, None)   # (JPEG bytes, base64) of the latest frame; either may be filled lazily
+        self._last_decoded = (None, None)  # (JPEG bytes, read-only BGR) of the last decode
+        self._planes_cache = (None, None)  # (read-only BGR, _frame_planes output) of the last search
         self._original_dimensions = None  # (height, width) when proposals were made
         self._jpeg_quality = 75
-        self._has_skimage = HAS_SKIMAGE
+        # Baseline, unoptimised Huffman tables, 4:2:0 chroma: the cheapest
+        # encode for a live stream, pinned so it doesn't depend on the build.
+        self._jpeg_params = [
+            cv2.IMWRITE_JPEG_QUALITY, self._jpeg_quality,
+            cv2.IMWRITE_JPEG_OPTIMIZE, 0,
+            cv2.IMWRITE_JPEG_PROGRESSIVE, 0,
+            cv2.IMWRITE_JPEG_SAMPLING_FACTOR, cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420,
+        ]
+        self._work_max_side = 720     # _find_contours segments at most this long a side
+        self._sam2_max_masks = 400    # matches the _store_proposals limit
+        self._proposal_cache = OrderedDict()  # (frame digest, query, backend) -> (proposals, dims, result)
+        self._proposal_cache_size = 4
+        self._contour_tasks = OrderedDict()   # (frame digest, region, backend) -> task -> (contours, backend)
         self._has_cellpose = HAS_CELLPOSE
         self._has_sam2 = HAS_SAM2
         self._default_backend = os.getenv("SEGMENTATION_BACKEND", "auto").strip().lower()
@@ -51,6 +224,24 @@ class Segmenter:
 
         self._cellpose_model = None
         self._sam2_mask_generator = None
+        self._cellpose_lock = threading.Lock()
+        self._sam2_lock = threading.Lock()
+        self._local = threading.local()  # per-thread OpenCV objects (CLAHE keeps state)
+        self._sam2_device = "cpu"
+        self._cellpose_device = "cpu"
+        self._sam2_masks = (None, None)  # (frame digest, _sam2_crops output) for the last SAM2 frame
+        # One long-lived thread for per-frame overlay work, so WS rendering never
+        # queues behind segmentation or decodes in the default to_thread pool.
+        self._render_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="render")
+        # Long-lived threads for contour searches, so their per-thread scratch
+        # buffers and CLAHE stay warm between requests. Two, so a prefetch
+        # doesn't queue behind a stalled model search.
+        self._search_workers = ThreadPoolExecutor(max_workers=2, thread_name_prefix="search")
+        # A timed-out search keeps its thread, so the OpenCV fallback gets its
+        # own; otherwise two stalled model searches would starve it.
+        self._fallback_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fallback")
+        # Small pool the independent stages of _build_candidate_mask fan out to.
+        self._stage_pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix="stage")
         
         # Color palette for overlays
         self.colors = [
@@ -66,10 +257,51 @@ class Segmenter:
         
         print(
             "✅ Segmenter ready "
-            f"(default={self._default_backend}, skimage={self._has_skimage}, "
+            f"(default={self._default_backend}, "
             f"cellpose={self._has_cellpose}, sam2={self._has_sam2}, auto_fast={self._auto_fast_mode})"
         )
 
+        # Build + warm the models requests will actually use, off the startup
+        # path; a request that needs one before it is ready waits on its lock.
+        selected = self._resolve_backend()
+        refine = selected == "auto" and not self._auto_fast_mode
+        warm = []
+        if HAS_NUMBA:
+            # First, so an early OpenCV search doesn't pay the JIT compile.
+            warm.append(self._warm_kernels)
+        if selected == "cellpose" or (refine and self._has_cellpose):
+            warm.append(self._get_cellpose_model)
+        if selected == "sam2" or (refine and self._has_sam2):
+            warm.append(self._get_sam2_generator)
+        if warm:
+            threading.Thread(target=self._warm_models, args=(warm,), name="model-warmup", daemon=True).start()
+
+    @staticmethod
+    def _warm_kernels() -> None:
+        """Compile (or load from cache) the numba kernels on a tiny frame.
+
+        Argument types mirror the real calls in _build_candidate_mask and
+        _watershed_labels, channel views included, so those calls reuse
+        these specializations.
+        """
+        plane = np.zeros((2, 2), dtype=np.uint8)
+        chans = np.zeros((2, 2, 3), dtype=np.uint8)
+        with _parallel_guard():
+            _vote_kernel(
+                plane, 0.0, plane, plane, 0.0, plane,
+                plane, 0, chans[:, :, 1], 0, chans[:, :, 1], chans[:, :, 2],
+                0, 0, 0, 0, plane, np.empty_like(plane),
+            )
+        _flood_kernel(np.zeros((2, 2), dtype=np.float32), plane, np.zeros((2, 2), dtype=np.int32))
+
+    @staticmethod
+    def _warm_models(getters: list) -> None:
+        for getter in getters:
+            try:
+                getter()
+            except Exception as err:
+                print(f"⚠️ Model warmup failed ({getter.__name__}): {err}")
+
     def _resolve_backend(self, backend: str | None = None) -> str:
         selected = (backend or self._default_backend or "auto").strip().lower()
         if selected not in {"auto", "opencv", "cellpose", "sam2"}:
@@ -88,8 +320,19 @@ class Segmenter:
     def _get_cellpose_model(self):
         if not self._has_cellpose:
             return None
-        if self._cellpose_model is None:
-            self._cellpose_model = cellpose_models.CellposeModel(gpu=torch.cuda.is_available())
+        if self._cellpose_model is not None:
+            return self._cellpose_model
+        with self._cellpose_lock:
+            if self._cellpose_model is None:
+                gpu = torch.cuda.is_available()
+                model = cellpose_models.CellposeModel(gpu=gpu)
+                self._cellpose_device = "cuda" if gpu else "cpu"
+                # Throwaway pass with the real eval settings, so the first
+                # request doesn't pay for CUDA/cuDNN setup.
+                dummy = np.random.default_rng(0).integers(0, 256, (256, 256, 3), dtype=np.uint8)
+                with torch.inference_mode(), self._autocast(self._cellpose_device):
+                    model.eval(dummy, diameter=None, flow_threshold=0.4, cellprob_threshold=0.0, normalize=True)
+                self._cellpose_model = model
         return self._cellpose_model
 
     def _get_sam2_generator(self):
@@ -97,63 +340,150 @@ class Segmenter:
             return None
         if self._sam2_mask_generator is not None:
             return self._sam2_mask_generator
+        with self._sam2_lock:
+            if self._sam2_mask_generator is None:
+                self._build_sam2_generator()
+        return self._sam2_mask_generator
 
+    def _build_sam2_generator(self) -> None:
         ckpt = os.getenv("SAM2_CHECKPOINT", "").strip()
         cfg = os.getenv("SAM2_MODEL_CFG", "sam2_hiera_t.yaml").strip()
         if not ckpt:
-            return None
+            return
 
         device = "cuda" if torch is not None and torch.cuda.is_available() else "cpu"
         model = build_sam2(cfg, ckpt, device=device)
-        self._sam2_mask_generator = SAM2AutomaticMaskGenerator(model)
-        return self._sam2_mask_generator
-
-    @staticmethod
-    def _sanitize_contour(contour: np.ndarray) -> np.ndarray | None:
-        if contour is None:
-            return None
-        contour = np.asarray(contour)
-        if contour.ndim == 2 and contour.shape[1] == 2:
-            contour = contour.reshape(-1, 1, 2)
-        if contour.ndim != 3 or contour.shape[1] != 1 or contour.shape[2] != 2:
-            return None
-
-        contour = contour.astype(np.int32)
-        if len(contour) < 3:
-            return None
-
-        area = float(cv2.contourArea(contour))
-        if area <= 8.0:
-            return None
+        model.eval()
+        # SAM2_ENCODER_ENGINE: optional prebuilt TensorRT (BF16) image encoder
+        # saved as TorchScript, for CUDA only; the light decoder stays in
+        # PyTorch. Contract: a drop-in for model.image_encoder built from the
+        # same SAM2_MODEL_CFG. It takes a (B, 3, image_size, image_size)
+        # float tensor and returns a dict with "vision_features" (Tensor),
+        # "vision_pos_enc" and "backbone_fpn" (lists of per-level Tensors, at
+        # least num_feature_levels long). E.g. torch.jit.trace the encoder with
+        # strict=False after torch_tensorrt.compile. An engine that doesn't
+        # load or match is ignored and the encoder is torch.compiled instead.
+        engine = os.getenv("SAM2_ENCODER_ENGINE", "").strip()
+        encoder = None
+        if device == "cuda" and engine and os.path.exists(engine):
+            encoder = self._load_sam2_engine(engine, model, device)
+        use_engine = encoder is not None
+        if use_engine:
+            model.image_encoder = encoder
+        else:
+            # NHWC conv weights suit TensorCores and oneDNN alike.
+            model.image_encoder = model.image_encoder.to(memory_format=torch.channels_last)
+
+        if device == "cuda" and not use_engine:
+            # Hiera encoder dominates; fuse its kernels (SAMfast recipe).
+            model.image_encoder = torch.compile(model.image_encoder, mode="reduce-overhead", fullgraph=False)
+        elif device == "cpu":
+            # Decoder/prompt encoder are mostly Linear layers; their output is
+            # thresholded anyway, so int8 dynamic quantization is safe here.
+            model.sam_mask_decoder = torch.ao.quantization.quantize_dynamic(
+                model.sam_mask_decoder, {torch.nn.Linear}, dtype=torch.qint8
+            )
+            model.sam_prompt_encoder = torch.ao.quantization.quantize_dynamic(
+                model.sam_prompt_encoder, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        self._sam2_device = device
+        # 16x16 prompts instead of the default 32x32 quarters the decoder work;
+        # dense fields of small cells can raise it via SAM2_POINTS_PER_SIDE.
+        # The point grid itself is built once here and reused by generate().
+        generator = SAM2AutomaticMaskGenerator(
+            model,
+            points_per_side=int(os.getenv("SAM2_POINTS_PER_SIDE", "16")),
+            points_per_batch=256,
+            pred_iou_thresh=0.86,
+            stability_score_thresh=0.9,
+            box_nms_thresh=0.7,
+        )
 
-        x, y, w, h = cv2.boundingRect(contour)
-        if w <= 1 or h <= 1:
+        # One throwaway pass so compile / cuDNN autotuning happen now rather
+        # than on the first real frame.
+        dummy = np.zeros((1024, 1024, 3), dtype=np.uint8)
+        with torch.inference_mode(), self._autocast(device):
+            generator.generate(dummy)
+        # Published last, so the lock-free fast path never sees a cold one.
+        self._sam2_mask_generator = generator
+
+    def _load_sam2_engine(self, engine: str, model, device: str):
+        """The TorchScript encoder at *engine*, or None if it breaks the contract."""
+        levels = getattr(model, "num_feature_levels", None)
+        size = getattr(model, "image_size", 1024)
+        try:
+            encoder = torch.jit.load(engine, map_location=device)
+            dummy = torch.zeros((1, 3, size, size), device=device)
+            with torch.inference_mode(), self._autocast(device):
+                out = encoder(dummy)
+            ok = (
+                isinstance(out, dict)
+                and isinstance(out.get("vision_features"), torch.Tensor)
+                and all(
+                    isinstance(out.get(k), (list, tuple))
+                    and all(isinstance(t, torch.Tensor) for t in out[k])
+                    and (levels is None or len(out[k]) >= levels)
+                    for k in ("vision_pos_enc", "backbone_fpn")
+                )
+            )
+        except Exception as e:
+            print(f"⚠️ SAM2 encoder engine {engine} failed to load: {e}")
             return None
-
-        aspect = max(w, h) / max(1.0, min(w, h))
-        if aspect > 16.0:
+        if not ok:
+            keys = sorted(out) if isinstance(out, dict) else type(out).__name__
+            print(f"⚠️ SAM2 encoder engine {engine} has the wrong outputs ({keys}); using the compiled encoder")
             return None
+        print(f"✅ SAM2 encoder engine loaded: {engine}")
+        return encoder
 
-        return contour
+    @staticmethod
+    def _sanitize_contour(contour: np.ndarray) -> np.ndarray | None:
+        sanitized = Segmenter._sanitize_contours([contour])
+        return sanitized[0] if sanitized else None
 
     @staticmethod
-    def _contours_to_binary_mask(h: int, w: int, contours: list[np.ndarray]) -> np.ndarray:
-        mask = np.zeros((h, w), dtype=np.uint8)
-        valid = []
+    def _sanitize_contours(contours: list, stats: bool = False) -> list[np.ndarray] | tuple:
+        """Drop malformed or degenerate contours; survivors as (N, 1, 2) int32.
+
+        With *stats*, returns ``(survivors, areas, rects)`` so callers can
+        reuse the contour areas and bounding rects computed here.
+        """
+        shaped = []
         for contour in contours:
-            sanitized = Segmenter._sanitize_contour(contour)
-            if sanitized is not None:
-                valid.append(sanitized)
-        if valid:
-            cv2.drawContours(mask, valid, -1, 255, thickness=cv2.FILLED)
-        return mask
+            if contour is None:
+                continue
+            contour = np.asarray(contour)
+            if contour.ndim == 2 and contour.shape[1] == 2:
+                contour = contour.reshape(-1, 1, 2)
+            if contour.ndim != 3 or contour.shape[1] != 1 or contour.shape[2] != 2 or len(contour) < 3:
+                continue
+            shaped.append(contour.astype(np.int32, copy=False))
+        if not shaped:
+            return ([], np.empty(0), np.empty((0, 4), dtype=np.int32)) if stats else []
+
+        n = len(shaped)
+        areas = np.fromiter((cv2.contourArea(c) for c in shaped), dtype=np.float64, count=n)
+        rects = np.array([cv2.boundingRect(c) for c in shaped], dtype=np.int32).reshape(n, 4)
+        w, h = rects[:, 2], rects[:, 3]
+        aspect = np.maximum(w, h) / np.maximum(1.0, np.minimum(w, h))
+        keep = np.flatnonzero((areas > 8.0) & (w > 1) & (h > 1) & (aspect <= 16.0))
+        survivors = [shaped[i] for i in keep.tolist()]
+        return (survivors, areas[keep], rects[keep]) if stats else survivors
+
+    # Columns of the proposal feature matrix.
+    _FEATURES = ("area", "circularity", "cx", "cy", "x", "y", "w", "h")
 
     @staticmethod
-    def _contour_features(contour: np.ndarray) -> dict:
-        area = float(cv2.contourArea(contour))
+    def _contour_features(contour: np.ndarray, area: float | None = None, rect: tuple | None = None) -> tuple:
+        """Return one feature row, in _FEATURES order.
+
+        *area* and *rect* may carry already-computed ``contourArea`` and
+        ``boundingRect`` results for *contour*.
+        """
+        area = float(cv2.contourArea(contour)) if area is None else float(area)
         perimeter = float(cv2.arcLength(contour, True))
         circularity = float((4.0 * np.pi * area) / (perimeter * perimeter)) if perimeter > 0 else 0.0
-        x, y, w, h = cv2.boundingRect(contour)
+        x, y, w, h = cv2.boundingRect(contour) if rect is None else rect
         M = cv2.moments(contour)
         if M["m00"] > 0:
             cx = int(M["m10"] / M["m00"])
@@ -161,99 +491,214 @@ class Segmenter:
         else:
             cx = x + w // 2
             cy = y + h // 2
-        return {
-            "area": area,
-            "circularity": circularity,
-            "center": [int(cx), int(cy)],
-            "bbox": [int(x), int(y), int(w), int(h)],
-        }
+        return area, circularity, cx, cy, x, y, w, h
 
     @staticmethod
-    def _query_score(query: str, feat: dict, img_area: float = 1.0) -> float:
-        """Score a candidate contour for relevance to *query*.
+    def _parse_query(query: str) -> _QueryFlags:
+        """Reduce *query* to the keyword flags _query_scores cares about."""
+        q = (query or "").lower()
+        rbc = "red blood" in q or "rbc" in q
+        return _QueryFlags(
+            rbc=rbc,
+            cell=not rbc and ("all" in q or "cell" in q),
+            large="large" in q,
+            small="small" in q,
+        )
+
+    @classmethod
+    def _query_scores(cls, query: str, feats: np.ndarray, img_area: float = 1.0) -> np.ndarray:
+        """Score every feature row in *feats* for relevance to *query*.
 
         All area thresholds are expressed as fractions of *img_area* so
         the scoring is resolution-independent.
         """
-        q = (query or "").lower()
-        score = 0.0
-        area = feat["area"]
-        circularity = feat["circularity"]
-        w = max(feat["bbox"][2], 1)
-        h = max(feat["bbox"][3], 1)
-        aspect = max(w, h) / max(1.0, min(w, h))
+        flags = cls._parse_query(query)
+        area, circularity = feats[:, 0], feats[:, 1]
+        w = np.maximum(feats[:, 6], 1)
+        h = np.maximum(feats[:, 7], 1)
+        aspect = np.maximum(w, h) / np.maximum(1.0, np.minimum(w, h))
 
         # Normalised area (fraction of image).  A typical microscopy
         # red blood cell is ~0.5 %–2 % of the field-of-view.
         rel_area = area / max(img_area, 1.0)
 
         # Base score: prefer reasonably sized, round objects
-        score += min(1.0, rel_area / 0.0003)   # saturates at ~0.03 % of image
-        score += circularity
+        scores = np.minimum(1.0, rel_area / 0.0003)   # saturates at ~0.03 % of image
+        scores += circularity
 
-        if "red blood" in q or "rbc" in q:
-            score += 1.3 * circularity
+        if flags.rbc:
+            scores += 1.3 * circularity
             # RBC-sized sweet spot: 0.3 %–2.5 % of the image
-            if 0.003 <= rel_area <= 0.025:
-                score += 0.8
+            scores += np.where((rel_area >= 0.003) & (rel_area <= 0.025), 0.8, 0.0)
             # Penalise very tiny specks (< 0.005 % of image)
-            if rel_area < 0.00005:
-                score -= 0.6
-            if aspect <= 1.5:
-                score += 0.5
-        elif "all" in q or "cell" in q:
-            score += 0.3
+            scores -= np.where(rel_area < 0.00005, 0.6, 0.0)
+            scores += np.where(aspect <= 1.5, 0.5, 0.0)
+        elif flags.cell:
+            scores += 0.3
 
-        if "large" in q:
-            score += min(1.2, rel_area / 0.002)
-        if "small" in q:
-            score += 0.9 if rel_area < 0.0003 else -0.3
+        if flags.large:
+            scores += np.minimum(1.2, rel_area / 0.002)
+        if flags.small:
+            scores += np.where(rel_area < 0.0003, 0.9, -0.3)
 
-        return float(score)
+        return scores
 
     @staticmethod
-    def _region_mask(query: str, h: int, w: int) -> np.ndarray:
-        mask = np.ones((h, w), dtype=np.uint8) * 255
-        q = query.lower()
-        if "bottom" in q:
-            mask[:h // 2, :] = 0
-        elif "top" in q:
-            mask[h // 2:, :] = 0
-        elif "left" in q:
-            mask[:, w // 2:] = 0
-        elif "right" in q:
-            mask[:, :w // 2] = 0
-        return mask
+    def _region_roi(query: str, h: int, w: int) -> tuple[int, int, int, int]:
+        """``(y0, y1, x0, x1)`` of the image half *query* asks for (else the whole frame)."""
+        region = Segmenter._region_key(query)
+        if region == "bottom":
+            return h // 2, h, 0, w
+        if region == "top":
+            return 0, h // 2, 0, w
+        if region == "left":
+            return 0, h, 0, w // 2
+        if region == "right":
+            return 0, h, w // 2, w
+        return 0, h, 0, w
+
+    @property
+    def masks_version(self) -> int:
+        """Bumped whenever the active masks change."""
+        return self._masks_version
 
     @property
     def latest_b64(self) -> str | None:
         """Raw base64 string (no data-uri prefix)."""
-        return self._latest_b64
+        latest = self._latest
+        jpeg, raw = latest
+        if raw is None and jpeg is not None:
+            # Only base64-encoded when someone asks.
+            raw = _b64.b64encode(jpeg).decode('ascii')
+            if self._latest is latest:
+                self._latest = (jpeg, raw)
+        return raw
+
+    @property
+    def latest_jpeg(self) -> bytes | None:
+        """JPEG bytes of the latest frame."""
+        latest = self._latest
+        jpeg, raw = latest
+        if jpeg is None and raw is not None:
+            # Passthrough frames are stored as base64; decoded on first use.
+            jpeg = self._b64_jpeg(raw)
+            if jpeg is not None and self._latest is latest:
+                self._latest = (jpeg, raw)
+        return jpeg
+
+    def _set_latest(self, jpeg: bytes | None, raw_b64: str | None = None) -> None:
+        """Make *jpeg* (or, if None, the base64 *raw_b64*) the latest frame."""
+        self._latest = (jpeg, raw_b64)
 
     @staticmethod
-    def _decode(raw_b64: str) -> np.ndarray | None:
-        """Decode base64 string to BGR image."""
+    def _b64_jpeg(raw_b64: str) -> bytes | None:
+        """Base64 (no data-uri prefix) to JPEG bytes, or None if malformed."""
         try:
-            buf = np.frombuffer(base64.b64decode(raw_b64), np.uint8)
-            return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+            return _b64.b64decode(raw_b64)
         except Exception as e:
             print(f"⚠️ Decode error: {e}")
             return None
 
+    @staticmethod
+    def _decode_jpeg(data) -> np.ndarray | None:
+        """Decode JPEG bytes to BGR image (libjpeg-turbo SIMD path when available)."""
+        if HAS_TURBOJPEG:
+            try:
+                return _TURBOJPEG.decode(data, pixel_format=TJPF_BGR)
+            except Exception:
+                pass  # not a JPEG (or corrupt); let OpenCV have a go
+        return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+    def _decode_shared(self, jpeg: bytes) -> np.ndarray | None:
+        """Decode JPEG bytes, reusing the last result when the bytes repeat.
+
+        The same frame is typically decoded for rendering, by the agent and
+        by propose_masks; the array is shared between them, so it is
+        read-only and must be copied before drawing on it.
+        """
+        last_jpeg, last_img = self._last_decoded
+        if last_jpeg == jpeg:
+            return last_img
+        img = self._decode_jpeg(jpeg)
+        if img is not None:
+            img.flags.writeable = False
+            self._last_decoded = (jpeg, img)
+        return img
+
+    def _decode(self, raw_b64: str) -> np.ndarray | None:
+        """Decode base64 string to (shared, read-only) BGR image."""
+        try:
+            return self._decode_shared(_b64.b64decode(raw_b64))
+        except Exception as e:
+            print(f"⚠️ Decode error: {e}")
+            return None
+
+    def _encode_jpeg(self, img: np.ndarray) -> bytes:
+        """Encode BGR image to JPEG bytes."""
+        if HAS_TURBOJPEG:
+            # 4:2:0 like OpenCV's encoder; PyTurboJPEG defaults to larger 4:2:2.
+            return _TURBOJPEG.encode(
+                img, quality=self._jpeg_quality, pixel_format=TJPF_BGR, jpeg_subsample=TJSAMP_420
+            )
+        _, buffer = cv2.imencode('.jpg', img, self._jpeg_params)
+        return buffer.tobytes()
+
     def _encode(self, img: np.ndarray) -> str:
         """Encode BGR image to base64 string."""
-        _, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, self._jpeg_quality])
-        return base64.b64encode(buffer).decode('utf-8')
+        return _b64.b64encode(self._encode_jpeg(img)).decode('ascii')
+
+    def encode_scaled(self, img: np.ndarray, max_side: int) -> str:
+        """Encode BGR image to base64, shrinking it so max(h, w) <= *max_side*."""
+        h, w = img.shape[:2]
+        scale = max_side / float(max(h, w))
+        if scale < 1.0:
+            img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return self._encode(img)
+
+    def _clahe(self):
+        """CLAHE instance for the calling thread, created once per thread."""
+        clahe = getattr(self._local, "clahe", None)
+        if clahe is None:
+            clahe = self._local.clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        return clahe
+
+    def _scratch(self, key: str, shape: tuple, dtype=np.uint8, zero: bool = False) -> np.ndarray:
+        """Reusable per-thread buffer for *key*; reallocated only when the shape changes.
+
+        Contents are whatever the last user left unless *zero* is set, and the
+        buffer is only valid until the same thread asks for *key* again.
+        """
+        bufs = getattr(self._local, "scratch", None)
+        if bufs is None:
+            bufs = self._local.scratch = {}
+        buf = bufs.get(key)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = bufs[key] = np.empty(shape, dtype=dtype)
+        if zero:
+            buf.fill(0)
+        return buf
+
+    @staticmethod
+    def _fill_holes(mask: np.ndarray) -> np.ndarray:
+        """Fill holes in a 0/255 mask, like ``scipy.ndimage.binary_fill_holes``.
+
+        Flood the background from the border of a zero-padded copy; whatever
+        zero is left unreached is a hole.
+        """
+        padded = cv2.copyMakeBorder(mask, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+        cv2.floodFill(padded, None, (0, 0), 255)
+        return cv2.bitwise_or(mask, cv2.bitwise_not(padded[1:-1, 1:-1]))
 
-    def _detect_microscope_mask(self, img: np.ndarray) -> np.ndarray:
+    def _detect_microscope_mask(self, img: np.ndarray, gray: np.ndarray | None = None) -> np.ndarray:
         """Estimate valid field-of-view mask and suppress microscope rim."""
         h, w = img.shape[:2]
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        if gray is None:
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
-        threshold = max(8, int(np.percentile(gray, 15)))
+        threshold = max(8, self._hist_percentile(cv2.calcHist([gray], [0], None, [256], [0, 256]), 15))
         _, candidate = cv2.threshold(gray, threshold, 255, cv2.THRESH_BINARY)
 
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (13, 13))
+        kernel = _ellipse(13)
         candidate = cv2.morphologyEx(candidate, cv2.MORPH_CLOSE, kernel, iterations=2)
 
         num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(candidate, connectivity=8)
@@ -270,11 +715,10 @@ class Segmenter:
             best = int(np.argmax(areas)) + 1
             fov = (labels == best).astype(np.uint8) * 255
 
-        if self._has_skimage and ndi is not None:
-            fov = (ndi.binary_fill_holes(fov > 0).astype(np.uint8) * 255)
+        fov = self._fill_holes(fov)
 
         erosion_px = max(3, int(min(h, w) * 0.02))
-        erode_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * erosion_px + 1, 2 * erosion_px + 1))
+        erode_kernel = _ellipse(2 * erosion_px + 1)
         fov = cv2.erode(fov, erode_kernel, iterations=1)
         return fov
 
@@ -284,149 +728,380 @@ class Segmenter:
         if not np.any(binary):
             return binary
 
-        edge_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (17, 17))
+        edge_kernel = _ellipse(17)
         inner = cv2.erode(roi_mask, edge_kernel, iterations=1)
         edge_band = cv2.subtract(roi_mask, inner)
 
         num_labels, labels, stats, _ = cv2.connectedComponentsWithStats((binary > 0).astype(np.uint8), connectivity=8)
-        cleaned = np.zeros_like(binary)
-        for label in range(1, num_labels):
-            area = stats[label, cv2.CC_STAT_AREA]
-            if area <= 0:
-                continue
-            comp = (labels == label).astype(np.uint8)
-            touch_ratio = (np.sum((comp > 0) & (edge_band > 0)) / area)
-            if touch_ratio < 0.12:
-                cleaned[comp > 0] = 255
-        return cleaned
-
-    def _build_candidate_mask(self, img: np.ndarray, roi_mask: np.ndarray) -> np.ndarray:
-        """Build a robust foreground mask by combining multiple cues."""
-        h, w = img.shape[:2]
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        # Edge-band pixels per component in one bincount, then one gather to
+        # paint the survivors, instead of a full-frame pass per component.
+        area = stats[:, cv2.CC_STAT_AREA]
+        touch = np.bincount(labels[edge_band > 0], minlength=num_labels)
+        keep = (area > 0) & (touch / np.maximum(area, 1) < 0.12)
+        keep[0] = False
+        lut = np.where(keep, 255, 0).astype(binary.dtype)
+        return lut[labels]
 
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        gray_eq = clahe.apply(gray)
-        gray_blur = cv2.GaussianBlur(gray_eq, (5, 5), 0)
+    @staticmethod
+    def _hist_percentile(hist: np.ndarray, q: float) -> int:
+        """``int(np.percentile(values, q))`` given the histogram of *values*.
 
+        Mirrors NumPy's default linear interpolation between the two
+        neighbouring order statistics, read off the cumulative counts.
+        """
+        cum = np.cumsum(np.asarray(hist, dtype=np.float64).ravel())
+        n = int(round(cum[-1]))
+        virtual = (n - 1) * (q / 100)
+        if virtual >= n - 1:
+            return int(np.searchsorted(cum, n - 1, side="right"))
+        k = int(np.floor(virtual))
+        t = virtual - k
+        lo = int(np.searchsorted(cum, k, side="right"))
+        hi = int(np.searchsorted(cum, k + 1, side="right"))
+        diff = hi - lo
+        return int(hi - diff * (1 - t) if t >= 0.5 else lo + diff * t)
+
+    def _build_candidate_mask(
+        self, img: np.ndarray, roi_mask: np.ndarray, gray: np.ndarray | None = None
+    ) -> np.ndarray:
+        """Build a robust foreground mask by combining multiple cues.
+
+        *gray* may carry the grayscale of *img* when the caller already has it.
+        """
+        h, w = img.shape[:2]
+        # The colour conversions, the background blur and the adaptive
+        # thresholds are independent of each other and OpenCV drops the GIL,
+        # so they overlap on _stage_pool while this thread does the rest.
+        pool = self._stage_pool
+        lab_f = pool.submit(cv2.cvtColor, img, cv2.COLOR_BGR2LAB)
+        hsv_f = pool.submit(cv2.cvtColor, img, cv2.COLOR_BGR2HSV)
+        if gray is None:
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+        gray_eq = self._clahe().apply(gray)
         sigma = max(10.0, float(min(h, w)) * 0.06)
-        bg = cv2.GaussianBlur(gray_eq, (0, 0), sigmaX=sigma, sigmaY=sigma)
-        gray_norm = ((gray_eq.astype(np.float32) + 1.0) / (bg.astype(np.float32) + 1.0))
-        gray_norm = cv2.normalize(gray_norm, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
-        gray_norm_blur = cv2.GaussianBlur(gray_norm, (5, 5), 0)
-
-        _, m_otsu = cv2.threshold(gray_blur, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-        m_adapt = cv2.adaptiveThreshold(
-            gray_blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        bg_f = pool.submit(cv2.GaussianBlur, gray_eq, (0, 0), sigmaX=sigma, sigmaY=sigma)
+        gray_blur = cv2.GaussianBlur(gray_eq, (5, 5), 0)
+        adapt_f = pool.submit(
+            cv2.adaptiveThreshold, gray_blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
             cv2.THRESH_BINARY_INV, 31, 4
         )
-        _, m_otsu_norm = cv2.threshold(gray_norm_blur, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-        m_adapt_norm = cv2.adaptiveThreshold(
-            gray_norm_blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        # The Otsu masks are only cues for the NumPy vote; the numba kernel
+        # compares against the levels itself, so there both masks go to one
+        # discarded scratch (cv2.threshold is still the cheapest way to the
+        # level: a separate histogram pass measured slower).
+        otsu_dst = self._scratch("otsu_discard", (h, w)) if HAS_NUMBA else None
+        otsu_thr, m_otsu = cv2.threshold(gray_blur, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU, dst=otsu_dst)
+
+        # Flat-field ratio in two reused float buffers instead of four
+        # per-frame float temporaries.
+        num = self._scratch("norm_num", (h, w), np.float32)
+        den = self._scratch("norm_den", (h, w), np.float32)
+        np.copyto(num, gray_eq)
+        num += 1.0
+        np.copyto(den, bg_f.result())
+        den += 1.0
+        np.divide(num, den, out=num)
+        cv2.normalize(num, num, 0, 255, cv2.NORM_MINMAX)
+        gray_norm = self._scratch("norm_u8", (h, w))
+        np.copyto(gray_norm, num, casting="unsafe")
+        gray_norm_blur = cv2.GaussianBlur(gray_norm, (5, 5), 0)
+
+        adapt_norm_f = pool.submit(
+            cv2.adaptiveThreshold, gray_norm_blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
             cv2.THRESH_BINARY_INV, 31, 3
         )
+        otsu_norm_thr, m_otsu_norm = cv2.threshold(
+            gray_norm_blur, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU, dst=otsu_dst
+        )
 
-        blackhat_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (9, 9))
+        blackhat_kernel = _ellipse(9)
         blackhat = cv2.morphologyEx(gray_norm_blur, cv2.MORPH_BLACKHAT, blackhat_kernel)
-        bh_thr = int(np.percentile(blackhat[roi_mask > 0], 75)) if np.any(roi_mask > 0) else 20
-        m_blackhat = (blackhat > max(12, bh_thr)).astype(np.uint8) * 255
+        m_adapt, m_adapt_norm = adapt_f.result(), adapt_norm_f.result()
+        lab, hsv = lab_f.result(), hsv_f.result()
+        # ROI percentiles from histograms: O(N + bins), no masked gathers or
+        # partial sorts. Same values as int(np.percentile(x[roi > 0], q)).
+        has_roi = cv2.countNonZero(roi_mask) > 0
+        if has_roi:
+            ab_hist = cv2.calcHist([lab], [1, 2], roi_mask, [256, 256], [0, 256, 0, 256])
+            a_hist = ab_hist.sum(axis=1)
+            b_hist = ab_hist.sum(axis=0)
+            bh_thr = self._hist_percentile(cv2.calcHist([blackhat], [0], roi_mask, [256], [0, 256]), 75)
+            s_thr = self._hist_percentile(cv2.calcHist([hsv], [1], roi_mask, [256], [0, 256]), 60)
+            med_a = self._hist_percentile(a_hist, 50)
+            med_b = self._hist_percentile(b_hist, 50)
+            # stain_dev = |a - med_a| + |b - med_b| for every (a, b) bin
+            levels = np.arange(256)
+            dev_grid = np.abs(levels - med_a)[:, None] + np.abs(levels - med_b)[None, :]
+            dev_hist = np.bincount(dev_grid.ravel(), weights=ab_hist.ravel(), minlength=511)
+            dev_thr = self._hist_percentile(dev_hist, 65)
+            a_thr = self._hist_percentile(a_hist, 62)
+        else:
+            bh_thr, s_thr, med_a, med_b, dev_thr, a_thr = 20, 40, 128, 128, 30, 132
 
         s = hsv[:, :, 1]
-        s_thr = int(np.percentile(s[roi_mask > 0], 60)) if np.any(roi_mask > 0) else 40
-        m_sat = (s > max(18, s_thr - 8)).astype(np.uint8) * 255
-
-        a_u8 = lab[:, :, 1].astype(np.uint8)
-        a = a_u8.astype(np.int16)
-        b = lab[:, :, 2].astype(np.int16)
-        med_a = int(np.median(a[roi_mask > 0])) if np.any(roi_mask > 0) else 128
-        med_b = int(np.median(b[roi_mask > 0])) if np.any(roi_mask > 0) else 128
-        stain_dev = np.abs(a - med_a) + np.abs(b - med_b)
-        dev_thr = int(np.percentile(stain_dev[roi_mask > 0], 65)) if np.any(roi_mask > 0) else 30
-        m_stain = (stain_dev > max(18, dev_thr)).astype(np.uint8) * 255
-
-        a_thr = int(np.percentile(a_u8[roi_mask > 0], 62)) if np.any(roi_mask > 0) else 132
-        m_red = (a_u8 > max(128, a_thr)).astype(np.uint8) * 255
-
-        votes = (m_otsu > 0).astype(np.uint8)
-        votes += (m_adapt > 0).astype(np.uint8)
-        votes += (m_otsu_norm > 0).astype(np.uint8)
-        votes += (m_adapt_norm > 0).astype(np.uint8)
-        votes += (m_blackhat > 0).astype(np.uint8)
-        votes += (m_sat > 0).astype(np.uint8)
-        votes += (m_stain > 0).astype(np.uint8)
-        votes += (m_red > 0).astype(np.uint8)
-        combined = (votes >= 3).astype(np.uint8) * 255
-
-        combined = cv2.bitwise_and(combined, roi_mask)
-        kernel3 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-        kernel5 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
-        combined = cv2.morphologyEx(combined, cv2.MORPH_OPEN, kernel3, iterations=1)
-        combined = cv2.morphologyEx(combined, cv2.MORPH_CLOSE, kernel5, iterations=2)
+        a_u8 = lab[:, :, 1]
+
+        if HAS_NUMBA:
+            # Compare, vote and AND with the ROI in one fused pass instead of
+            # eight mask temporaries plus the vote accumulator.
+            combined = self._scratch("votes", (h, w))
+            with _parallel_guard():
+                _vote_kernel(
+                    gray_blur, otsu_thr, m_adapt, gray_norm_blur, otsu_norm_thr, m_adapt_norm,
+                    blackhat, max(12, bh_thr), s, max(18, s_thr - 8), a_u8, lab[:, :, 2],
+                    med_a, med_b, max(18, dev_thr), max(128, a_thr), roi_mask, combined,
+                )
+        else:
+            # |a - med_a| + |b - med_b| in uint8 SIMD, summed unsaturated.
+            stain_dev = cv2.add(
+                cv2.absdiff(a_u8, med_a), cv2.absdiff(lab[:, :, 2], med_b), dtype=cv2.CV_16U
+            )
+            # Count votes in place: one reused hit buffer and one accumulator
+            # instead of a uint8 mask plus a cast temporary per cue.
+            votes = self._scratch("vote_count", (h, w), zero=True)
+            hit = self._scratch("vote_hit", (h, w), dtype=bool)
+            cues = (
+                (m_otsu, 0), (m_adapt, 0), (m_otsu_norm, 0), (m_adapt_norm, 0),
+                (blackhat, max(12, bh_thr)),
+                (s, max(18, s_thr - 8)),
+                (stain_dev, max(18, dev_thr)),
+                (a_u8, max(128, a_thr)),
+            )
+            for cue, thr in cues:
+                np.greater(cue, thr, out=hit)
+                np.add(votes, hit, out=votes, casting="unsafe")
+            combined = self._scratch("votes", (h, w))
+            cv2.compare(votes, 3, cv2.CMP_GE, dst=combined)
+            cv2.bitwise_and(combined, roi_mask, dst=combined)
+
+        kernel3 = _ellipse(3)
+        kernel5 = _ellipse(5)
+        opened = self._scratch("opened", (h, w))
+        cv2.morphologyEx(combined, cv2.MORPH_OPEN, kernel3, dst=opened, iterations=1)
+        cv2.morphologyEx(opened, cv2.MORPH_CLOSE, kernel5, dst=combined, iterations=2)
         combined = self._remove_edge_connected(combined, roi_mask)
         return combined
 
-    def _watershed_labels(self, mask: np.ndarray) -> np.ndarray:
+    @staticmethod
+    def _components(binary: np.ndarray) -> tuple[np.ndarray, tuple]:
+        """8-connected components plus their bboxes (see :meth:`_label_boxes`)."""
+        n, labels, stats, _ = cv2.connectedComponentsWithStatsWithAlgorithm(
+            binary, 8, cv2.CV_32S, cv2.CCL_BBDT
+        )
+        x0 = stats[1:, cv2.CC_STAT_LEFT]
+        y0 = stats[1:, cv2.CC_STAT_TOP]
+        boxes = (
+            np.arange(1, n),
+            x0,
+            y0,
+            x0 + stats[1:, cv2.CC_STAT_WIDTH],
+            y0 + stats[1:, cv2.CC_STAT_HEIGHT],
+        )
+        return labels, boxes
+
+    def _watershed_labels(self, mask: np.ndarray) -> tuple[np.ndarray, tuple | None]:
+        """Instance labels for *mask*, plus their bboxes when they come for free.
+
+        Components labelled by OpenCV carry their stats; watershed output
+        does not, and returns ``None`` for the boxes.
+        """
         if not np.any(mask):
-            return np.zeros(mask.shape, dtype=np.int32)
+            return self._components(np.zeros(mask.shape, dtype=np.uint8))
 
         dist = cv2.distanceTransform(mask, cv2.DIST_L2, 5)
         if float(dist.max()) <= 0:
-            _, labels = cv2.connectedComponents(mask)
-            return labels.astype(np.int32)
-
-        if self._has_skimage and feature is not None and segmentation is not None and ndi is not None:
-            peaks = feature.peak_local_max(
-                dist,
-                labels=(mask > 0),
-                min_distance=7,
-                exclude_border=False,
-            )
-            markers = np.zeros(mask.shape, dtype=np.int32)
-            if peaks.size > 0:
-                markers[peaks[:, 0], peaks[:, 1]] = np.arange(1, len(peaks) + 1)
-            else:
-                sure = (dist > (0.45 * dist.max())).astype(np.uint8)
-                _, markers = cv2.connectedComponents(sure)
-                markers = markers.astype(np.int32)
+            return self._components(mask)
+
+        # Seeds: local maxima of the distance map over a 15x15 window, like
+        # peak_local_max(min_distance=7). A seed has to sit at least 1.5px
+        # inside the mask (slivers and rim noise are not cell cores), and
+        # maxima within ~7px of each other are joined into one seed, so a
+        # noisy ridge or plateau doesn't split one cell into several.
+        peaks = cv2.compare(dist, cv2.dilate(dist, _rect(15)), cv2.CMP_GE)
+        peaks = cv2.bitwise_and(peaks, cv2.compare(dist, 1.5, cv2.CMP_GE))
+        peaks = cv2.bitwise_and(peaks, mask)
+        if not cv2.countNonZero(peaks):
+            return self._components(mask)
+        joined = cv2.bitwise_and(cv2.dilate(peaks, _ellipse(7)), mask)
+        _, seeds = cv2.connectedComponents(joined, connectivity=8, ltype=cv2.CV_32S)
+
+        markers = np.where(peaks > 0, seeds, 0).astype(np.int32)
+        if HAS_NUMBA:
+            # Flood -dist from the seeds: touching cells split along their neck.
+            labels = markers
+            _flood_kernel(dist, mask, labels)
+        else:
+            labels = self._nearest_seed_labels(mask, peaks, markers)
 
-            labels = segmentation.watershed(-dist, markers, mask=(mask > 0))
-            return labels.astype(np.int32)
+        # A component without a seed (a thin sliver) is its own instance.
+        orphans = cv2.bitwise_and(cv2.compare(labels, 0, cv2.CMP_EQ), mask)
+        if cv2.countNonZero(orphans):
+            _, extra = cv2.connectedComponents(orphans, connectivity=8, ltype=cv2.CV_32S)
+            hit = extra > 0
+            labels[hit] = extra[hit] + int(labels.max())
+        return labels, None
 
-        sure = (dist > (0.45 * dist.max())).astype(np.uint8) * 255
-        _, labels = cv2.connectedComponents(sure)
-        return labels.astype(np.int32)
+    @staticmethod
+    def _nearest_seed_labels(mask: np.ndarray, peaks: np.ndarray, markers: np.ndarray) -> np.ndarray:
+        """Approximate watershed without numba: each pixel takes its nearest seed.
 
-    def _find_contours(self, img: np.ndarray, query: str) -> list:
-        """Model-agnostic robust segmentation for microscopy and similar imagery."""
-        h, w = img.shape[:2]
+        Only seeds in the pixel's own connected component count. This is a
+        Euclidean Voronoi split, so between touching cells of unequal size the
+        line sits nearer the larger cell than the true neck. Components with
+        no seed are left at 0.
+        """
+        n, comps, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8, ltype=cv2.CV_32S)
+        ys, xs = np.nonzero(peaks)
+        pairs = np.unique(np.stack([comps[ys, xs], markers[ys, xs]]), axis=1)
+        per_comp = np.bincount(pairs[0], minlength=n)
+
+        # A component with a single seed is that seed's instance outright.
+        lut = np.zeros(n, dtype=np.int32)
+        single = per_comp[pairs[0]] == 1
+        lut[pairs[0][single]] = pairs[1][single]
+        labels = lut[comps]
+
+        for comp in np.flatnonzero(per_comp > 1).tolist():
+            x, y, w, h = stats[comp, :4]
+            own = comps[y:y + h, x:x + w] == comp
+            sub_peaks = np.where(own, peaks[y:y + h, x:x + w], 0).astype(np.uint8)
+            _, nearest = cv2.distanceTransformWithLabels(
+                cv2.bitwise_not(sub_peaks), cv2.DIST_L2, 5, labelType=cv2.DIST_LABEL_CCOMP
+            )
+            sy, sx = np.nonzero(sub_peaks)
+            seed_lut = np.zeros(int(nearest.max()) + 1, dtype=np.int32)
+            seed_lut[nearest[sy, sx]] = markers[y + sy, x + sx]
+            labels[y:y + h, x:x + w][own] = seed_lut[nearest][own]
+        return labels
+
+    @staticmethod
+    def _label_boxes(labels: np.ndarray) -> tuple:
+        """Labels present in *labels* (ascending, 0 excluded) and their bboxes.
 
-        fov_mask = self._detect_microscope_mask(img)
-        region_mask = self._region_mask(query, h, w)
-        roi_mask = cv2.bitwise_and(fov_mask, region_mask)
+        Returns ``(labels, x0, y0, x1, y1)`` arrays with exclusive x1/y1,
+        computed in one pass over the foreground pixels.
+        """
+        ys, xs = np.nonzero(labels)
+        if ys.size == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty, empty, empty
+        lab = labels[ys, xs]
+        order = np.argsort(lab, kind="stable")
+        lab, ys, xs = lab[order], ys[order], xs[order]
+        present, starts = np.unique(lab, return_index=True)
+        return (
+            present,
+            np.minimum.reduceat(xs, starts),
+            np.minimum.reduceat(ys, starts),
+            np.maximum.reduceat(xs, starts) + 1,
+            np.maximum.reduceat(ys, starts) + 1,
+        )
 
-        candidate = self._build_candidate_mask(img, roi_mask)
-        labels = self._watershed_labels(candidate)
+    def _frame_planes(self, img: np.ndarray) -> tuple:
+        """``(work image, gray, FOV mask, rim band)`` for *img*, query-independent.
 
-        min_area = max(12, int(h * w * 0.000012))
-        max_area = int(h * w * 0.03)
+        *work* is *img* shrunk to the working resolution. Read-only frames
+        (the shared decodes) are remembered by identity, so another region
+        query, a fallback or a retry on the same frame skips all of this.
+        """
+        cached_img, planes = self._planes_cache
+        if cached_img is img:
+            return planes
 
+        h, w = img.shape[:2]
+        # Every stage below is O(H*W); cells don't need more than the working
+        # resolution, so segment a downscaled copy and map the contours back.
+        work = img
+        scale = max(h, w) / self._work_max_side
+        if scale > 1.0:
+            work = cv2.resize(
+                img,
+                (max(1, round(w / scale)), max(1, round(h / scale))),
+                interpolation=cv2.INTER_AREA,
+            )
+
+        # One grayscale conversion for both the FOV mask and the cue stack.
+        gray = cv2.cvtColor(work, cv2.COLOR_BGR2GRAY)
+        fov_mask = self._detect_microscope_mask(work, gray)
+        # The rim band is 13 full-resolution pixels wide, whatever the working size.
         rim_band = cv2.subtract(fov_mask, cv2.erode(
             fov_mask,
-            cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (13, 13)),
+            _ellipse(max(3, round(13 / max(scale, 1.0)) | 1)),
             iterations=1,
         ))
+        planes = (work, gray, fov_mask, rim_band)
+        if not img.flags.writeable:
+            self._planes_cache = (img, planes)
+        return planes
 
-        filtered = []
-        seen_centers = set()
-        max_label = int(labels.max())
-        for label in range(1, max_label + 1):
-            inst = (labels == label).astype(np.uint8) * 255
-            if not np.any(inst):
-                continue
+    def _find_contours(self, img: np.ndarray, query: str) -> list:
+        """Model-agnostic robust segmentation for microscopy and similar imagery."""
+        h, w = img.shape[:2]
+        work, gray, fov_mask, rim_band = self._frame_planes(img)
+        if work is img:
+            return self._segment(img, gray, fov_mask, rim_band, query)
+        sx, sy = w / work.shape[1], h / work.shape[0]
+        return [
+            np.round((c + 0.5) * (sx, sy) - 0.5).astype(np.int32)
+            for c in self._segment(work, gray, fov_mask, rim_band, query, px_scale=(sx, sy))
+        ]
+
+    def _segment(
+        self,
+        img: np.ndarray,
+        gray: np.ndarray,
+        fov_mask: np.ndarray,
+        rim_band: np.ndarray,
+        query: str,
+        px_scale: tuple = (1.0, 1.0),
+    ) -> list:
+        """Contours of the cells in *query*'s region of a working-size frame.
+
+        *px_scale* is the (x, y) size of one working pixel in original-frame
+        pixels; the absolute gates below are in original pixels.
+        """
+        h, w = img.shape[:2]
+        sx, sy = px_scale
+
+        # A directional query only looks at one half of the frame: run the
+        # rest of the pipeline on that crop, plus a 1px zero ROI margin on the
+        # cut side so the edge band still sees the region boundary.
+        ry0, ry1, rx0, rx1 = self._region_roi(query, h, w)
+        oy0, oy1, ox0, ox1 = max(0, ry0 - 1), min(h, ry1 + 1), max(0, rx0 - 1), min(w, rx1 + 1)
+        roi_mask = fov_mask[oy0:oy1, ox0:ox1].copy()
+        roi_mask[:ry0 - oy0] = 0
+        roi_mask[ry1 - oy0:] = 0
+        roi_mask[:, :rx0 - ox0] = 0
+        roi_mask[:, rx1 - ox0:] = 0
+        ch, cw = roi_mask.shape
+
+        candidate = self._build_candidate_mask(img[oy0:oy1, ox0:ox1], roi_mask, gray[oy0:oy1, ox0:ox1])
+        labels, boxes = self._watershed_labels(candidate)
+
+        min_area = max(12 / (sx * sy), int(h * w * 0.000012))
+        max_area = int(h * w * 0.03)
+        # De-duplication grid: 4 original pixels per cell.
+        grid_x, grid_y = 4 / sx, 4 / sy
 
-            cnts, _ = cv2.findContours(inst, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        rim_scratch = self._scratch("rim", (h, w))
+
+        kept = []    # (contour, perimeter, area, grid x, grid y)
+        max_label = int(labels.max())
+        present, x0s, y0s, x1s, y1s = boxes if boxes is not None else self._label_boxes(labels)
+        # A contour runs through pixel centres inside its bbox, so its area is
+        # at most (bw - 1) * (bh - 1): drop specks that can never reach
+        # min_area before any per-label work.
+        big = (x1s - x0s - 1) * (y1s - y0s - 1) >= min_area
+        present, x0s, y0s, x1s, y1s = present[big], x0s[big], y0s[big], x1s[big], y1s[big]
+        for label, x0, y0, x1, y1 in zip(present.tolist(), x0s.tolist(), y0s.tolist(), x1s.tolist(), y1s.tolist()):
+            # Trace each instance inside its own bbox (+1px so the image
+            # border behaves as before) instead of scanning the full frame.
+            ya, yb, xa, xb = max(0, y0 - 1), min(ch, y1 + 1), max(0, x0 - 1), min(cw, x1 + 1)
+            inst = cv2.compare(labels[ya:yb, xa:xb], label, cv2.CMP_EQ)
+            cnts, _ = cv2.findContours(
+                inst, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(xa + ox0, ya + oy0)
+            )
             if not cnts:
                 continue
             contour = max(cnts, key=cv2.contourArea)
@@ -447,25 +1122,36 @@ class Segmenter:
             if solidity < 0.55:
                 continue
 
-            c_mask = np.zeros((h, w), dtype=np.uint8)
-            cv2.drawContours(c_mask, [contour], -1, 255, cv2.FILLED)
-            edge_overlap = np.sum((c_mask > 0) & (rim_band > 0))
+            # Rim overlap only needs the contour's own bbox, not a full frame.
+            bx, by, bw, bh = cv2.boundingRect(contour)
+            c_mask = rim_scratch[:bh, :bw]
+            c_mask.fill(0)
+            cv2.drawContours(c_mask, [contour], -1, 255, cv2.FILLED, offset=(-bx, -by))
+            cv2.bitwise_and(c_mask, rim_band[by:by + bh, bx:bx + bw], dst=c_mask)
+            edge_overlap = cv2.countNonZero(c_mask)
             if edge_overlap > 0.08 * area:
                 continue
 
             M = cv2.moments(contour)
             if M["m00"] <= 0:
                 continue
-            cx = int((M["m10"] / M["m00"]) / 4) * 4
-            cy = int((M["m01"] / M["m00"]) / 4) * 4
-            key = (cx, cy)
-            if key in seen_centers:
-                continue
-            seen_centers.add(key)
 
-            eps = 0.007 * perimeter
-            approx = cv2.approxPolyDP(contour, eps, True)
-            filtered.append(approx)
+            # Centroid snapped to the de-duplication grid.
+            kept.append((contour, perimeter, area, int((M["m10"] / M["m00"]) / grid_x), int((M["m01"] / M["m00"]) / grid_y)))
+
+        filtered = []
+        if kept:
+            # One contour per grid cell: the largest, ties to the earlier label;
+            # only the winners are simplified.
+            areas = np.array([k[2] for k in kept], dtype=np.float64)
+            keys = np.array([k[4] for k in kept], dtype=np.int64) * (int(w / grid_x) + 1) + [k[3] for k in kept]
+            order = np.lexsort((-areas, keys))
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = keys[order[1:]] != keys[order[:-1]]
+            filtered = [
+                cv2.approxPolyDP(kept[i][0], 0.007 * kept[i][1], True)
+                for i in np.sort(order[first]).tolist()
+            ]
 
         print(
             f"  ✅ Found {len(filtered)} valid objects "
@@ -479,38 +1165,43 @@ class Segmenter:
             return self._find_contours(img, query)
 
         h, w = img.shape[:2]
-        region_mask = self._region_mask(query, h, w)
-        bgr = img.copy()
-        bgr[region_mask == 0] = 0
+        y0, y1, x0, x1 = self._region_roi(query, h, w)
+        bgr = np.zeros_like(img)
+        bgr[y0:y1, x0:x1] = img[y0:y1, x0:x1]
 
         # Cellpose expects RGB
         rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
-        out = model.eval(
-            rgb,
-            diameter=None,
-            flow_threshold=0.4,
-            cellprob_threshold=0.0,
-            normalize=True,
-        )
+        with torch.inference_mode(), self._autocast(self._cellpose_device):
+            out = model.eval(
+                rgb,
+                diameter=None,
+                flow_threshold=0.4,
+                cellprob_threshold=0.0,
+                normalize=True,
+            )
         if isinstance(out, tuple):
             masks = out[0]
         else:
             masks = out
 
         contours = []
-        max_label = int(np.max(masks)) if masks is not None else 0
+        if masks is None or not np.any(masks):
+            print("  🧫 Cellpose found 0 contours")
+            return contours
         min_area = max(12, int(h * w * 0.00001))
         max_area = int(h * w * 0.05)
 
-        for label in range(1, max_label + 1):
-            inst = (masks == label).astype(np.uint8)
-            if not np.any(inst):
-                continue
-            area = int(np.sum(inst))
-            if area < min_area or area > max_area:
-                continue
-
-            cnts, _ = cv2.findContours(inst * 255, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # Areas in one bincount and bboxes in one pass, so each instance is
+        # compared and traced inside its own bbox rather than the full frame.
+        areas = np.bincount(masks.ravel())
+        present, x0s, y0s, x1s, y1s = self._label_boxes(masks)
+        keep = (areas[present] >= min_area) & (areas[present] <= max_area)
+        for label, x0, y0, x1, y1 in zip(
+            present[keep].tolist(), x0s[keep].tolist(), y0s[keep].tolist(), x1s[keep].tolist(), y1s[keep].tolist()
+        ):
+            ya, yb, xa, xb = max(0, y0 - 1), min(h, y1 + 1), max(0, x0 - 1), min(w, x1 + 1)
+            inst = (masks[ya:yb, xa:xb] == label).astype(np.uint8)
+            cnts, _ = cv2.findContours(inst * 255, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(xa, ya))
             if not cnts:
                 continue
             contour = max(cnts, key=cv2.contourArea)
@@ -521,31 +1212,50 @@ class Segmenter:
         print(f"  🧫 Cellpose found {len(contours)} contours")
         return contours
 
+    @staticmethod
+    def _autocast(device: str):
+        """Mixed-precision context for inference on *device* (CUDA only).
+
+        bf16 where the GPU has native support (Ampere+), fp16 otherwise.
+        """
+        if device == "cuda":
+            dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+            return torch.autocast(device_type="cuda", dtype=dtype)
+        return contextlib.nullcontext()
+
     def _find_contours_sam2(self, img: np.ndarray, query: str) -> list:
         generator = self._get_sam2_generator()
         if generator is None:
             return self._find_contours(img, query)
 
         h, w = img.shape[:2]
-        region_mask = self._region_mask(query, h, w)
-        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-        masks = generator.generate(rgb)
+        y0, y1, x0, x1 = self._region_roi(query, h, w)
+        # The image encoder is the expensive part and does not depend on the
+        # query; reuse its masks when another region is asked of this frame.
+        digest = hashlib.blake2b(np.ascontiguousarray(img).data, digest_size=16).digest()
+        cached_digest, masks = self._sam2_masks
+        if cached_digest != digest:
+            with torch.inference_mode(), self._autocast(self._sam2_device):
+                generated = generator.generate(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+            masks = self._sam2_crops(generated, h, w)
+            self._sam2_masks = (digest, masks)
         contours = []
         min_area = max(12, int(h * w * 0.00001))
         max_area = int(h * w * 0.05)
 
-        for md in masks:
-            seg = md.get("segmentation")
-            if seg is None:
+        for crop, xa, ya in masks:
+            # Only look at the mask's own bbox within the query region.
+            ch, cw = crop.shape
+            ca, cb = max(y0, ya), min(y1, ya + ch)
+            cc, cd = max(x0, xa), min(x1, xa + cw)
+            if ca >= cb or cc >= cd:
                 continue
-            seg_u8 = seg.astype(np.uint8)
-            seg_u8[region_mask == 0] = 0
-            area = int(np.sum(seg_u8 > 0))
+            seg_u8 = crop[ca - ya:cb - ya, cc - xa:cd - xa]
+            area = cv2.countNonZero(seg_u8)
             if area < min_area or area > max_area:
                 continue
 
-            cnts, _ = cv2.findContours(seg_u8 * 255, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            cnts, _ = cv2.findContours(seg_u8, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(cc, ca))
             if not cnts:
                 continue
             contour = max(cnts, key=cv2.contourArea)
@@ -556,6 +1266,43 @@ class Segmenter:
         print(f"  🧠 SAM2 found {len(contours)} contours")
         return contours
 
+    def _sam2_crops(self, masks: list, h: int, w: int) -> list:
+        """``(crop, x, y)`` per usable generator mask, most confident first.
+
+        Only the mask's bbox (padded a pixel for rounding) is kept, as 0/255
+        uint8, so the per-frame cache doesn't hold full-frame segmentations.
+        """
+        min_area = max(12, int(h * w * 0.00001))
+
+        # Pre-filter on the generator's own areas (region masking can only
+        # shrink a mask) and keep the most confident masks, best first.
+        count = len(masks)
+        areas = np.fromiter((md.get("area", min_area) for md in masks), dtype=np.int64, count=count)
+        ious = np.fromiter((md.get("predicted_iou", 0.0) for md in masks), dtype=np.float32, count=count)
+        keep = np.flatnonzero(areas >= min_area)
+        if keep.size > self._sam2_max_masks:
+            keep = keep[np.argpartition(-ious[keep], self._sam2_max_masks)[:self._sam2_max_masks]]
+        keep = keep[np.argsort(-ious[keep], kind="stable")]
+
+        crops = []
+        for i in keep.tolist():
+            md = masks[i]
+            seg = md.get("segmentation")
+            if seg is None:
+                continue
+            ya, yb, xa, xb = 0, h, 0, w
+            bbox = md.get("bbox")  # XYWH
+            if bbox is not None:
+                bx, by, bw, bh = bbox
+                ya, yb = max(0, int(by) - 1), min(h, int(np.ceil(by + bh)) + 2)
+                xa, xb = max(0, int(bx) - 1), min(w, int(np.ceil(bx + bw)) + 2)
+                if ya >= yb or xa >= xb:
+                    continue
+            crop = seg[ya:yb, xa:xb].astype(np.uint8)
+            crop *= 255
+            crops.append((crop, xa, ya))
+        return crops
+
     def _find_contours_dispatch(self, img: np.ndarray, query: str, backend: str | None = None) -> tuple[list, str]:
         mode = (backend or self._default_backend or "auto").strip().lower()
         if mode == "auto":
@@ -602,105 +1349,255 @@ class Segmenter:
             print(f"⚠️ Backend '{selected}' failed: {err} — falling back to opencv")
             return self._find_contours(img, query), "opencv"
 
-    def _store_proposals(self, contours: list[np.ndarray], query: str, img_shape: tuple, limit: int = 400) -> list[dict]:
+    def _store_proposals(self, contours: list[np.ndarray], query: str, img_shape: tuple, limit: int = 400) -> None:
         img_area = float(img_shape[0]) * float(img_shape[1])  # h * w
-        proposals = []
-        for contour in contours:
-            contour = self._sanitize_contour(contour)
-            if contour is None:
-                continue
-            feat = self._contour_features(contour)
-            score = self._query_score(query, feat, img_area=img_area)
-            proposals.append({
-                "contour": contour,
-                "area": feat["area"],
-                "circularity": feat["circularity"],
-                "center": feat["center"],
-                "bbox": feat["bbox"],
-                "score": score,
-            })
-
-        proposals.sort(key=lambda p: p["score"], reverse=True)
-        self.latest_proposals = proposals[:max(1, limit)]
-        self._original_dimensions = img_shape[:2]  # Store (height, width)
-        return self.latest_proposals
-
-    async def propose_masks(self, query: str, frame_b64: str | None = None, backend: str | None = None) -> str:
+        valid, areas, rects = self._sanitize_contours(contours, stats=True)
+        rows = [
+            self._contour_features(contour, area, rect)
+            for contour, area, rect in zip(valid, areas.tolist(), rects.tolist())
+        ]
+
+        feats = np.array(rows, dtype=np.float64).reshape(len(rows), len(self._FEATURES))
+        scores = self._query_scores(query, feats, img_area=img_area)
+        ids = np.arange(self._next_contour_id, self._next_contour_id + len(valid), dtype=np.int64)
+        self._next_contour_id += len(valid)
+        # Stable, so ties keep contour order as the old list.sort did.
+        order = np.argsort(-scores, kind="stable")[:max(1, limit)]
+        self._set_proposals(
+            ([valid[i] for i in order], feats[order], scores[order], ids[order]),
+            img_shape[:2],  # (height, width)
+        )
+
+    def _set_proposals(self, proposals: tuple | None, dims: tuple[int, int] | None) -> None:
+        """Replace the current proposals with *(contours, features, scores, ids)*."""
+        if proposals is None:
+            proposals = (
+                [],
+                np.empty((0, len(self._FEATURES)), dtype=np.float64),
+                np.empty(0, dtype=np.float64),
+                np.empty(0, dtype=np.int64),
+            )
+        self._proposal_contours, self._proposal_features, self._proposal_scores, self._proposal_ids = proposals
+        self._proposal_view = None
+        self._original_dimensions = dims
+
+    @property
+    def latest_proposals(self) -> list[dict]:
+        """Proposals as {contour, area, circularity, center, bbox, score} dicts."""
+        if self._proposal_view is None:
+            self._proposal_view = [
+                {
+                    "contour": contour,
+                    "area": area,
+                    "circularity": circ,
+                    "center": [int(cx), int(cy)],
+                    "bbox": [int(x), int(y), int(w), int(h)],
+                    "score": score,
+                }
+                for contour, (area, circ, cx, cy, x, y, w, h), score in zip(
+                    self._proposal_contours,
+                    self._proposal_features.tolist(),
+                    self._proposal_scores.tolist(),
+                )
+            ]
+        return self._proposal_view
+
+    def decode_frame(self, frame_b64: str) -> np.ndarray | None:
+        """Decode a base64 frame (data-URI prefix optional) to BGR."""
+        raw = frame_b64.split(',', 1)[-1] if ',' in frame_b64 else frame_b64
+        return self._decode(raw)
+
+    async def propose_masks(
+        self,
+        query: str,
+        frame_b64: str | None = None,
+        backend: str | None = None,
+        frame_img: np.ndarray | None = None,
+    ) -> str:
+        """Propose candidate masks for *query*.
+
+        *frame_img* may carry an already-decoded copy of *frame_b64* so
+        repeated calls within one agent turn skip the base64 + JPEG decode.
+        """
         img = None
         source = None
+        jpeg = None
 
         # Prefer the explicitly-provided frame (sent with the POST /query)
-        # over _latest_b64, which races with the WS stream and may be a
+        # over the latest WS frame, which races with the stream and may be a
         # completely different camera view by now.
         if frame_b64:
             raw = frame_b64.split(',', 1)[-1] if ',' in frame_b64 else frame_b64
-            img = self._decode(raw)
+            jpeg = self._b64_jpeg(raw)
+            if jpeg is not None:
+                img = frame_img if frame_img is not None else self._decode_shared(jpeg)
             if img is not None:
                 source = "frame_b64"
                 # Pin this frame so render_frame uses the same reference
-                self._latest_b64 = raw
+                self._set_latest(jpeg, raw)
 
-        if img is None and self._latest_b64:
-            img = self._decode(self._latest_b64)
-            source = "_latest_b64"
+        if img is None:
+            jpeg = self.latest_jpeg
+            if jpeg is not None:
+                img = self._decode_shared(jpeg)
+                source = "latest_frame"
 
         if img is None:
             return "No image available - send a frame over the WebSocket first."
 
         requested_backend = (backend or self._default_backend or "auto").strip().lower()
         selected_backend = self._resolve_backend(requested_backend)
+        digest = self._frame_digest(jpeg)
+
+        # The agent sometimes re-proposes on the very same frame; replay the
+        # earlier result instead of segmenting again.
+        cache_key = (digest, query, selected_backend)
+        cached = self._proposal_cache.get(cache_key)
+        if cached is not None:
+            self._proposal_cache.move_to_end(cache_key)
+            proposals, dims, result = cached
+            self._set_proposals(proposals, dims)
+            print(f"🔬 Reusing proposals for: '{query}' (backend={selected_backend}, source={source})")
+            return result
+
         print(f"🔬 Proposing masks for: '{query}' (backend={selected_backend}, source={source}, img={img.shape[1]}x{img.shape[0]})")
-        timeout_sec = {
+        contours, used_backend = await self._contours_task(digest, img, query, selected_backend)
+
+        if not contours:
+            self._set_proposals(None, None)
+            return self._remember_proposals(
+                cache_key, self._summary(0, used_backend, [])
+            )
+
+        self._store_proposals(contours, query, img.shape)
+        n = min(60, len(self._proposal_contours))
+        feats = self._proposal_features[:n]
+        columns = zip(
+            np.round(feats[:, 0], 2).tolist(),
+            np.round(feats[:, 1], 3).tolist(),
+            feats[:, 2:4].astype(np.int32).tolist(),
+            feats[:, 4:8].astype(np.int32).tolist(),
+            np.round(self._proposal_scores[:n], 3).tolist(),
+        )
+        preview = [
+            {"index": i, "area": area, "circularity": circ, "center": center, "bbox": bbox, "score": score}
+            for i, (area, circ, center, bbox, score) in enumerate(columns)
+        ]
+
+        return self._remember_proposals(
+            cache_key, self._summary(len(self._proposal_contours), used_backend, preview)
+        )
+
+    @staticmethod
+    def _frame_digest(jpeg: bytes) -> bytes:
+        return hashlib.blake2b(jpeg, digest_size=16).digest()
+
+    @staticmethod
+    def _region_key(query: str) -> str:
+        """The part of *query* that contour finding depends on (see _region_roi)."""
+        q = (query or "").lower()
+        for region in ("bottom", "top", "left", "right"):
+            if region in q:
+                return region
+        return ""
+
+    def _contours_task(self, digest: bytes, img: np.ndarray, query: str, backend: str) -> asyncio.Future:
+        """Shared (possibly already running) contour search for this frame.
+
+        Contours only depend on the frame, the query's region and the
+        backend, so a search started early by prefetch_contours is picked
+        up here instead of being repeated.
+        """
+        key = (digest, self._region_key(query), backend)
+        task = self._contour_tasks.get(key)
+        if task is None or (task.done() and (task.cancelled() or task.exception() is not None)):
+            task = asyncio.ensure_future(self._run_contours(img, query, backend))
+            self._contour_tasks[key] = task
+        self._contour_tasks.move_to_end(key)
+        while len(self._contour_tasks) > self._proposal_cache_size:
+            self._contour_tasks.popitem(last=False)
+        return task
+
+    async def _run_contours(self, img: np.ndarray, query: str, selected_backend: str) -> tuple[list, str]:
+        timeouts = {
             "opencv": 2.0,
             "cellpose": 8.0,
             "sam2": 10.0,
             "auto": 12.0,
-        }.get(selected_backend, 6.0)
+        }
+        timeout_sec = timeouts.get(selected_backend, 6.0)
 
+        loop = asyncio.get_running_loop()
         try:
-            contours, used_backend = await asyncio.wait_for(
-                asyncio.to_thread(self._find_contours_dispatch, img, query, selected_backend),
+            return await asyncio.wait_for(
+                loop.run_in_executor(self._search_workers, self._find_contours_dispatch, img, query, selected_backend),
                 timeout=timeout_sec,
             )
         except TimeoutError:
             print(f"⚠️ Segmentation timeout on backend={selected_backend}; falling back to opencv")
             if selected_backend != "opencv":
-                contours, used_backend = await asyncio.to_thread(
-                    self._find_contours_dispatch,
-                    img,
-                    query,
-                    "opencv",
-                )
-            else:
-                contours, used_backend = [], "opencv"
+                try:
+                    return await asyncio.wait_for(
+                        loop.run_in_executor(
+                            self._fallback_worker, self._find_contours_dispatch, img, query, "opencv"
+                        ),
+                        timeout=timeouts["opencv"],
+                    )
+                except TimeoutError:
+                    print("⚠️ OpenCV fallback timed out too")
+            return [], "opencv"
+
+    def prefetch_contours(
+        self,
+        query: str,
+        frame_b64: str,
+        frame_img: np.ndarray | None = None,
+        backend: str | None = None,
+    ) -> None:
+        """Start finding contours for *frame_b64* in the background.
+
+        Lets the agent overlap segmentation with its first LLM round-trip;
+        a later propose_masks on the same frame and region awaits the result.
+        """
+        raw = frame_b64.split(',', 1)[-1] if ',' in frame_b64 else frame_b64
+        jpeg = self._b64_jpeg(raw)
+        if jpeg is None:
+            return
+        img = frame_img if frame_img is not None else self._decode_shared(jpeg)
+        if img is None:
+            return
+        selected = self._resolve_backend((backend or self._default_backend or "auto").strip().lower())
+        self._contours_task(self._frame_digest(jpeg), img, query, selected)
 
-        if not contours:
-            self.latest_proposals = []
-            self._original_dimensions = None
-            return json.dumps({"count": 0, "backend": used_backend, "candidates": []})
-
-        proposals = self._store_proposals(contours, query, img.shape)
-        preview = []
-        for i, p in enumerate(proposals[:60]):
-            preview.append({
-                "index": i,
-                "area": round(float(p["area"]), 2),
-                "circularity": round(float(p["circularity"]), 3),
-                "center": p["center"],
-                "bbox": p["bbox"],
-                "score": round(float(p["score"]), 3),
-            })
-
-        return json.dumps({"count": len(proposals), "backend": used_backend, "candidates": preview})
+    @staticmethod
+    def _summary(count: int, backend: str, candidates: list[dict]) -> str:
+        """Serialize the propose_masks result for the model in one pass.
+
+        Compact separators drop ~13% of the characters (and prompt tokens)
+        that the default ", " / ": " padding adds to every candidate.
+        """
+        return json.dumps(
+            {"count": count, "backend": backend, "candidates": candidates},
+            separators=(",", ":"),
+        )
+
+    def _remember_proposals(self, key: tuple, result: str) -> str:
+        proposals = (self._proposal_contours, self._proposal_features, self._proposal_scores, self._proposal_ids)
+        self._proposal_cache[key] = (proposals, self._original_dimensions, result)
+        self._proposal_cache.move_to_end(key)
+        while len(self._proposal_cache) > self._proposal_cache_size:
+            self._proposal_cache.popitem(last=False)
+        return result
 
     def apply_masks(self, indices: list[int], query: str = "selected masks") -> str:
-        if not self.latest_proposals:
+        if not self._proposal_contours:
             return "No proposals available. Call propose_masks first."
 
+        count = len(self._proposal_contours)
         valid = []
         seen = set()
         for idx in indices:
-            if isinstance(idx, int) and 0 <= idx < len(self.latest_proposals) and idx not in seen:
+            if isinstance(idx, int) and 0 <= idx < count and idx not in seen:
                 valid.append(idx)
                 seen.add(idx)
 
@@ -711,33 +1608,26 @@ class Segmenter:
 
         # If user asked for all/every, don't depend on tool-selected subset.
         q = (query or "").lower()
-        if ("all" in q or "every" in q) and len(self.latest_proposals) > len(valid):
-            valid = list(range(min(max_selected, len(self.latest_proposals))))
+        if ("all" in q or "every" in q) and count > len(valid):
+            valid = list(range(min(max_selected, count)))
 
         wants_specific = any(token in q for token in ["single", "one", "top", "best", "largest", "smallest"]) 
-        if not wants_specific and self.latest_proposals:
-            scores = [float(p.get("score", 0.0)) for p in self.latest_proposals]
-            peak = max(scores) if scores else 0.0
+        if not wants_specific and count:
+            peak = float(self._proposal_scores.max())
             # Include all proposals with "reasonable" confidence relative to peak.
             conf_floor = peak * 0.72
-            conf_indices = [i for i, p in enumerate(self.latest_proposals) if float(p.get("score", 0.0)) >= conf_floor]
+            conf_indices = np.flatnonzero(self._proposal_scores >= conf_floor).tolist()
             if len(conf_indices) > len(valid):
                 valid = sorted(set(valid).union(conf_indices))
 
         valid = valid[:max_selected]
 
-        selected = []
-        for i in valid:
-            contour = self._sanitize_contour(self.latest_proposals[i]["contour"])
-            if contour is not None:
-                selected.append(contour)
+        # Proposals were sanitized when they were stored.
+        selected = [self._proposal_contours[i] for i in valid]
 
         if not selected:
             return "Selected indices did not contain valid filled contours."
 
-        # Static behavior: replace prior rendered masks with the newly selected set.
-        self.active_masks.clear()
-
         color = self.colors[self.color_idx % len(self.colors)]
         self.color_idx += 1
 
@@ -746,24 +1636,38 @@ class Segmenter:
         orig_dims = self._original_dimensions  # (h, w) from propose_masks
         normalized = self._normalize_contours(selected, orig_dims)
         print(f"📐 apply_masks: original_dimensions={orig_dims}, contours={len(selected)}")
-        self.active_masks.append({
+        md = {
             "original_contours": selected,       # never modified
+            "contour_ids": self._proposal_ids[valid].tolist(),  # keys into _contour_rasters
             "normalized_contours": normalized,   # preferred scaling representation
             "original_dimensions": orig_dims,    # (h, w) they were found at
             "contours": None,                    # scaled copy – computed lazily
-            "raster": None,                      # binary mask  – computed lazily
+            "patches": None,                     # per-contour fill patches – computed lazily
             "scaled_for": None,                  # (h, w) the cache is valid for
             "color": color,
+            "lut": self._blend_lut(color),       # colour blend for render_frame
             "query": query,
-        })
+        }
+        # Static behavior: replace prior rendered masks with the newly
+        # selected set. One rebinding, then the version bump, so a render on
+        # another thread sees either the old list or the complete new one.
+        self.active_masks = [md]
+        self._masks_version += 1
         return f"Applied {len(selected)} mask(s) from indices {valid[:20]} for '{query}'."
 
-    async def segment(self, query: str, frame_b64: str | None = None) -> str:
-        """Backward-compatible convenience segmentation.
-
-        Current flow is proposal-first; this picks top proposals automatically.
+    async def segment(
+        self,
+        query: str,
+        frame_b64: str | None = None,
+        backend: str | None = None,
+        frame_img: np.ndarray | None = None,
+    ) -> str:
+        """Propose and apply in one step.
+
+        Picks the top proposals automatically, which lets the agent render a
+        whole-class request without a second tool round-trip.
         """
-        proposed = await self.propose_masks(query, frame_b64)
+        proposed = await self.propose_masks(query, frame_b64, backend=backend, frame_img=frame_img)
         try:
             payload = json.loads(proposed)
         except Exception:
@@ -780,9 +1684,10 @@ class Segmenter:
     def clear_masks(self) -> str:
         """Remove all active masks."""
         count = len(self.active_masks)
-        self.active_masks.clear()
-        self.latest_proposals = []
-        self._original_dimensions = None
+        self.active_masks = []
+        self._masks_version += 1
+        self._set_proposals(None, None)
+        self._sam2_masks = (None, None)
         self.color_idx = 0
         return f"Cleared {count} mask(s)."
 
@@ -790,6 +1695,22 @@ class Segmenter:
     # Scaling helpers
     # ------------------------------------------------------------------
 
+    @staticmethod
+    def _stack_contours(contours: list) -> tuple[np.ndarray, np.ndarray] | None:
+        """Well-formed (N, 1, 2) *contours* as one float64 point array plus split offsets.
+
+        Coordinate transforms then run as one NumPy op over every point,
+        and ``np.split(points, offsets)`` gives the per-contour arrays back.
+        """
+        shaped = [
+            c for c in (np.asarray(c) for c in contours if c is not None)
+            if c.ndim == 3 and c.shape[2] == 2
+        ]
+        if not shaped:
+            return None
+        offsets = np.cumsum([len(c) for c in shaped[:-1]], dtype=np.int64)
+        return np.concatenate(shaped).astype(np.float64), offsets
+
     @staticmethod
     def _normalize_contours(contours: list[np.ndarray], dims: tuple[int, int] | None) -> list[np.ndarray] | None:
         """Convert contours to [0,1] coordinates so scaling is resolution-independent."""
@@ -799,17 +1720,12 @@ class Segmenter:
         if h <= 0 or w <= 0:
             return None
 
-        normalized = []
-        for contour in contours:
-            if contour is None:
-                continue
-            c = np.asarray(contour).copy().astype(np.float64)
-            if c.ndim != 3 or c.shape[2] != 2:
-                continue
-            c[:, :, 0] = np.clip(c[:, :, 0] / float(w), 0.0, 1.0)
-            c[:, :, 1] = np.clip(c[:, :, 1] / float(h), 0.0, 1.0)
-            normalized.append(c)
-        return normalized
+        stacked = Segmenter._stack_contours(contours)
+        if stacked is None:
+            return []
+        points, offsets = stacked
+        np.clip(points / np.array([float(w), float(h)]), 0.0, 1.0, out=points)
+        return np.split(points, offsets)
 
     @staticmethod
     def _contours_from_normalized(norm_contours: list[np.ndarray], h: int, w: int) -> list[np.ndarray]:
@@ -817,17 +1733,12 @@ class Segmenter:
         if h <= 0 or w <= 0:
             return []
 
-        projected = []
-        for contour in norm_contours:
-            if contour is None:
-                continue
-            c = np.asarray(contour).copy().astype(np.float64)
-            if c.ndim != 3 or c.shape[2] != 2:
-                continue
-            c[:, :, 0] = np.clip(np.rint(c[:, :, 0] * float(w)), 0, max(0, w - 1))
-            c[:, :, 1] = np.clip(np.rint(c[:, :, 1] * float(h)), 0, max(0, h - 1))
-            projected.append(c.astype(np.int32))
-        return projected
+        stacked = Segmenter._stack_contours(norm_contours)
+        if stacked is None:
+            return []
+        points, offsets = stacked
+        points = np.clip(np.rint(points * np.array([float(w), float(h)])), 0, [max(0, w - 1), max(0, h - 1)])
+        return np.split(points.astype(np.int32), offsets)
 
     @staticmethod
     def _scale_contours(
@@ -842,22 +1753,19 @@ class Segmenter:
         scale_x = dst_w / max(orig_w, 1)
         scale_y = dst_h / max(orig_h, 1)
 
-        scaled = []
-        for contour in contours:
-            if contour is None:
-                continue
-            c = contour.copy().astype(np.float64)
-            c[:, :, 0] *= scale_x   # x
-            c[:, :, 1] *= scale_y   # y
-            scaled.append(c.astype(np.int32))
-        return scaled
+        stacked = Segmenter._stack_contours(contours)
+        if stacked is None:
+            return []
+        points, offsets = stacked
+        points *= np.array([scale_x, scale_y])
+        return np.split(points.astype(np.int32), offsets)
 
     def _ensure_scaled(self, md: dict, h: int, w: int) -> None:
-        """Lazily (re-)compute scaled contours + raster for a mask dict.
+        """Lazily (re-)compute scaled contours + fill patches for a mask dict.
 
         Always scales from *original_contours* so errors never accumulate.
         """
-        if md.get("scaled_for") == (h, w) and md.get("raster") is not None:
+        if md.get("scaled_for") == (h, w) and md.get("patches") is not None:
             return  # cache hit
 
         norm_contours = md.get("normalized_contours")
@@ -873,10 +1781,63 @@ class Segmenter:
             # Fallback: assume contours are already at current resolution
             scaled = [c.copy() for c in orig_contours if c is not None]
 
-        md["contours"] = scaled
-        md["raster"] = self._contours_to_binary_mask(h, w, scaled)
+        # The fill is kept as per-contour bbox patches, which outlive this
+        # mask: re-selecting overlapping proposals only rasterizes the
+        # contours that weren't drawn at this size before, and no full-frame
+        # mask is ever allocated.
+        ids = md.get("contour_ids") or [None] * len(scaled)
+        kept = []
+        patches = []
+        for cid, contour in zip(ids, scaled):
+            entry = self._contour_raster(cid, contour, h, w)
+            if entry is None:
+                continue
+            contour, box, patch = entry
+            kept.append(contour)
+            if patch is not None:
+                patches.append((box, patch))
+        md["contours"] = kept
+        md["patches"] = patches  # ((x0, y0, x1, y1), filled patch) per contour
         md["scaled_for"] = (h, w)
 
+    def _contour_raster(self, cid: int | None, contour: np.ndarray, h: int, w: int) -> tuple | None:
+        """Sanitized *contour*, its clipped bbox and filled patch at (h, w).
+
+        Cached by contour id; ``None`` when the contour doesn't survive
+        sanitizing at this size. The patch is ``None`` when the bbox lies
+        entirely outside the frame.
+        """
+        key = (cid, h, w)
+        if cid is not None and key in self._contour_rasters:
+            self._contour_rasters.move_to_end(key)
+            return self._contour_rasters[key]
+
+        sanitized = self._sanitize_contours([contour])
+        entry = None
+        if sanitized:
+            contour = sanitized[0]
+            x, y, bw, bh = cv2.boundingRect(contour)
+            x0, y0, x1, y1 = max(0, x), max(0, y), min(w, x + bw), min(h, y + bh)
+            patch = None
+            if x1 > x0 and y1 > y0:
+                patch = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+                cv2.drawContours(patch, [contour], -1, 255, thickness=cv2.FILLED, offset=(-x0, -y0))
+            entry = (contour, (x0, y0, x1, y1), patch)
+
+        if cid is not None:
+            self._contour_rasters[key] = entry
+            while len(self._contour_rasters) > self._contour_rasters_size:
+                self._contour_rasters.popitem(last=False)
+        return entry
+
+    async def render(self, frame: str | bytes) -> str | bytes:
+        """Render a WS frame on the render worker; bytes in, bytes out."""
+        fn = self.render_jpeg if isinstance(frame, bytes) else self.render_frame
+        if not self.active_masks:
+            # Passthrough is just bookkeeping; not worth a thread hop.
+            return fn(frame)
+        return await asyncio.get_running_loop().run_in_executor(self._render_worker, fn, frame)
+
     def render_frame(self, b64_frame: str) -> str:
         """Render the current frame with static mask overlays.
         
@@ -885,43 +1846,114 @@ class Segmenter:
         """
         # Strip data-URI prefix
         raw = b64_frame.split(',', 1)[-1] if ',' in b64_frame else b64_frame
-        self._latest_b64 = raw
-        
-        # Fast path: no overlays → passthrough (no decode/encode!)
-        if not self.active_masks:
+
+        # One snapshot for the whole render: apply/clear swap the list from
+        # the event loop. Version first, since apply bumps it after the swap.
+        version = self._masks_version
+        masks = self.active_masks
+
+        # A static scope keeps sending the same frame; replay its render
+        # (and its JPEG bytes, so not even the base64 is decoded again).
+        if masks:
+            key = (_payload_hash(raw.encode("ascii", "ignore")), version)
+            cached_key, cached, cached_jpeg = self._render_cache
+            if cached_key == key:
+                self._set_latest(cached_jpeg, raw)
+                return cached
+
+        # Fast path: no overlays → passthrough. Not even the base64 is
+        # decoded; latest_jpeg does that if a query ever needs this frame.
+        if not masks:
+            self._set_latest(None, raw)
             return raw
-        
+
+        # Decode the base64 once here; everything downstream works on bytes.
+        jpeg = self._b64_jpeg(raw)
+        if jpeg is None:
+            return raw
+        self._set_latest(jpeg, raw)
+
         # Decode, overlay, encode
-        img = self._decode(raw)
+        img = self._decode_shared(jpeg)
         if img is None:
             return raw
 
+        img = self._copy_for_render(img)
+        self._draw_overlays(img, masks)
+        out = self._encode(img)
+        self._render_cache = (key, out, jpeg)
+        return out
+
+    def render_jpeg(self, jpeg: bytes) -> bytes:
+        """Same as :meth:`render_frame` for raw JPEG bytes (binary WS frames)."""
+        self._set_latest(jpeg)
+
+        version = self._masks_version
+        masks = self.active_masks
+        if not masks:
+            return jpeg
+
+        key = (_payload_hash(jpeg), version)
+        cached_key, cached, _ = self._render_cache
+        if cached_key == key:
+            return cached
+
+        img = self._decode_shared(jpeg)
+        if img is None:
+            return jpeg
+
+        img = self._copy_for_render(img)
+        self._draw_overlays(img, masks)
+        out = self._encode_jpeg(img)
+        self._render_cache = (key, out, jpeg)
+        return out
+
+    @staticmethod
+    def _blend_lut(color: tuple) -> np.ndarray:
+        """Per-channel LUT of 0.55 * *color* + 0.45 * v, rounded as addWeighted does."""
+        fill = np.empty((1, 256, 3), dtype=np.uint8)
+        fill[:] = color
+        return cv2.addWeighted(fill, 0.55, _LEVELS3, 0.45, 0)
+
+    def _copy_for_render(self, img: np.ndarray) -> np.ndarray:
+        """Writable copy of a shared decoded frame, in a reused buffer."""
+        frame = self._scratch("render", img.shape)
+        np.copyto(frame, img)
+        return frame
+
+    def _draw_overlays(self, img: np.ndarray, masks: list) -> None:
+        """Blend *masks* (a snapshot of the active masks) into *img* in place."""
         h, w = img.shape[:2]
 
         # Ensure scaled contours + rasters match current frame dimensions.
-        for md in self.active_masks:
+        for md in masks:
             orig = md.get("original_dimensions")
             if orig and orig != (h, w):
                 print(f"⚠️ render_frame: frame={w}x{h} vs segmentation={orig[1]}x{orig[0]} — scaling")
             self._ensure_scaled(md, h, w)
         
-        # Draw all active masks with strong fill + clear boundaries
-        fill_layer = np.zeros_like(img, dtype=np.uint8)
-        
-        for mask in self.active_masks:
-            color = mask["color"]
-            raster = mask.get("raster")
-            if raster is None:
-                continue
-            fill_layer[raster > 0] = color
-
-        cv2.addWeighted(fill_layer, 0.55, img, 0.45, 0, dst=img)
-
-        for mask in self.active_masks:
-            contours = [self._sanitize_contour(c) for c in mask.get("contours", [])]
-            contours = [c for c in contours if c is not None]
+        # Draw all active masks with strong fill + clear boundaries.
+        # Same result as blending a full-frame colour layer 0.55/0.45, but the
+        # colour blend only touches each contour's bbox; everywhere else the
+        # layer is black, which is just the 0.45 dim below. The colour blend
+        # is a per-mask table lookup (see _blend_lut), not float multiplies.
+        # Overlapping contours of one mask tint their shared pixels from the
+        # same undimmed source through the same LUT, so each contour's own
+        # patch is enough; the union never needs materializing.
+        tinted = []
+        for mask in masks:
+            for (x0, y0, x1, y1), patch in mask.get("patches") or ():
+                tint = cv2.LUT(img[y0:y1, x0:x1], mask["lut"])
+                tinted.append((tint, patch, y0, y1, x0, x1))
+
+        # Single scale; rounds exactly like addWeighted(img, 0.45, img, 0, 0).
+        cv2.convertScaleAbs(img, dst=img, alpha=0.45)
+        for tint, sub_mask, y0, y1, x0, x1 in tinted:
+            cv2.copyTo(tint, sub_mask, img[y0:y1, x0:x1])
+
+        for mask in masks:
+            contours = mask.get("contours")
             if contours:
                 thickness = max(2, int(round(min(h, w) * 0.003)))
                 cv2.drawContours(img, contours, -1, mask["color"], thickness=thickness)
-        
-        return self._encode(img)
+
@@ -15,6 +15,23 @@ extension UIImage {
         return "data:image/jpeg;base64,\(base64String)"
     }
     
+    /// Shrinks the image so its longer side is at most `maxSide` pixels
+    /// (SAM2 works at 1024², so larger frames only cost bandwidth).
+    func downscaled(toMaxSide maxSide: CGFloat = 1024) -> UIImage {
+        let pixelWidth = size.width * scale
+        let pixelHeight = size.height * scale
+        let longest = max(pixelWidth, pixelHeight)
+        guard longest > maxSide else { return self }
+        
+        let ratio = maxSide / longest
+        let target = CGSize(width: (pixelWidth * ratio).rounded(), height: (pixelHeight * ratio).rounded())
+        let format = UIGraphicsImageRendererFormat.default()
+        format.scale = 1
+        return UIGraphicsImageRenderer(size: target, format: format).image { _ in
+            draw(in: CGRect(origin: .zero, size: target))
+        }
+    }
+    
 //    func changeWhiteToTransparent() -> UIImage? {
 //        guard let rawImageRef = self.cgImage else { return nil }
 //
@@ -35,10 +35,7 @@ final class EndpointViewModel: NSObject, ObservableObject, AVCaptureVideoDataOut
     
     // --- Network Properties ---
     private var webSocketTask: URLSessionWebSocketTask?
-    
-    struct InferenceWSSchema: Codable {
-        let frame: String
-    }
+    private var reconnectAttempts = 0
     
     struct InferenceHTTPSchema: Codable {
         let prompt: String
@@ -64,7 +61,7 @@ final class EndpointViewModel: NSObject, ObservableObject, AVCaptureVideoDataOut
     func captureImage(mode: CaptureMode, prompt: String? = nil) {
         requestSnapshot { [self] image in
             guard let img = image else { return }
-            let analysisImage = imageWithBoundingBoxOverlay(from: img)
+            let analysisImage = imageWithBoundingBoxOverlay(from: img).downscaled(toMaxSide: 1024)
             
             DispatchQueue.main.async {
                 self.capturedImage = img
@@ -100,6 +97,8 @@ final class EndpointViewModel: NSObject, ObservableObject, AVCaptureVideoDataOut
             print("❌ Invalid WS URL")
             return
         }
+        // Reuse the live connection instead of stacking a second one
+        if let task = webSocketTask, task.state == .running { return }
         webSocketTask = URLSession.shared.webSocketTask(with: url)
         webSocketTask?.resume()
         listenForMessages()
@@ -107,15 +106,33 @@ final class EndpointViewModel: NSObject, ObservableObject, AVCaptureVideoDataOut
     
     // 2. Recursive Listener
     private func listenForMessages() {
-        webSocketTask?.receive { [self] result in
+        guard let task = webSocketTask else { return }
+        task.receive { [self] result in
             switch result {
             case .success(let message):
+                self.reconnectAttempts = 0
                 self.handleMessage(message)
+                self.listenForMessages() // Recursion
             case .failure(let error):
+                // A failed task fails every receive instantly; drop it and reconnect instead of spinning
                 print("❌ WebSocket Receive Error: \(error)")
+                DispatchQueue.main.async { self.reconnectWebSocket(replacing: task) }
             }
-            
-            self.listenForMessages() // Recursion
+        }
+    }
+    
+    private func reconnectWebSocket(replacing task: URLSessionWebSocketTask) {
+        // Skip if the endpoint was closed or a newer task already took over
+        guard webSocketTask === task, intervalTimer != nil else { return }
+        task.cancel(with: .goingAway, reason: nil)
+        webSocketTask = nil
+        
+        let delay = min(pow(2.0, Double(reconnectAttempts)), 30)
+        reconnectAttempts += 1
+        print("🔄 Reconnecting WebSocket in \(Int(delay))s")
+        DispatchQueue.main.asyncAfter(deadline: .now() + delay) { [weak self] in
+            guard let self, self.webSocketTask == nil, self.intervalTimer != nil else { return }
+            self.setupWebSocket()
         }
     }
     
@@ -136,24 +153,25 @@ final class EndpointViewModel: NSObject, ObservableObject, AVCaptureVideoDataOut
                let masked = circularMaskedImage(from: cgImage) {
                 DispatchQueue.main.async { self.annotatedImage = UIImage(cgImage: masked) }
             }
-        default:
+        case .data(let imageData):
+            // Binary frames carry the annotated JPEG directly (no base64)
+            if let image = UIImage(data: imageData),
+               let cgImage = image.cgImage,
+               let masked = circularMaskedImage(from: cgImage) {
+                DispatchQueue.main.async { self.annotatedImage = UIImage(cgImage: masked) }
+            }
+        @unknown default:
             break
         }
     }
     
     // 4. Send Frame (WebSocket)
     func sendFrameWS(image: UIImage) {
-        guard let frameB64 = image.base64EncodedString() else { return }
-        let schema = InferenceWSSchema(frame: frameB64)
-        
-        do {
-            let jsonData = try JSONEncoder().encode(schema)
-            let message = URLSessionWebSocketTask.Message.data(jsonData)
-            webSocketTask?.send(message) { error in
-                if let error = error { print("❌ WS Send Error: \(error)") }
-            }
-        } catch {
-            print("❌ JSON Error: \(error)")
+        // Raw JPEG bytes: the server answers in kind, skipping base64 + JSON
+        guard let jpegData = image.jpegData(compressionQuality: 0.5) else { return }
+        let message = URLSessionWebSocketTask.Message.data(jpegData)
+        webSocketTask?.send(message) { error in
+            if let error = error { print("❌ WS Send Error: \(error)") }
         }
     }
     
@@ -343,6 +361,7 @@ final class EndpointViewModel: NSObject, ObservableObject, AVCaptureVideoDataOut
         setupWebSocket()
         
         // Continuous capture loop for WebSocket Streaming
+        intervalTimer?.invalidate()
         intervalTimer = Timer.scheduledTimer(withTimeInterval: 1/15, repeats: true) { [self] _ in
             captureImage(mode: .stream)
         }
@@ -351,6 +370,7 @@ final class EndpointViewModel: NSObject, ObservableObject, AVCaptureVideoDataOut
     func closeEndpoint() {
         webSocketTask?.cancel(with: .normalClosure, reason: nil)
         webSocketTask = nil
+        reconnectAttempts = 0
         sendClear()
         if deviceLockAcquired {
             device?.unlockForConfiguration()
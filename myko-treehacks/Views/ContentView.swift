@@ -250,7 +250,7 @@ struct ContentView: View {
     
     private func generateNotes(for image: UIImage) async -> String? {
         guard let url = URL(string: "https://\(ENDPOINT_URL_BASE)/query") else { return nil }
-        guard let frameB64 = image.base64EncodedString() else { return nil }
+        guard let frameB64 = image.downscaled(toMaxSide: 1024).base64EncodedString() else { return nil }
 
         let requestPayload = NotesInferenceRequest(
             prompt: screenshotNotesPrompt,
@@ -275,7 +275,7 @@ struct ContentView: View {
     
     private func generateTitle(for image: UIImage) async -> String? {
         guard let url = URL(string: "https://\(ENDPOINT_URL_BASE)/query") else { return nil }
-        guard let frameB64 = image.base64EncodedString() else { return nil }
+        guard let frameB64 = image.downscaled(toMaxSide: 1024).base64EncodedString() else { return nil }
 
         let requestPayload = NotesInferenceRequest(
             prompt: screenshotTitlePrompt,